@@ -0,0 +1,44 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# Microbenchmark of toggling 1000 breakpoints with :Bp, VimBreakPoint.find()
+# scanning all signs of the buffer against its (file, line) index.
+#
+# It runs inside Vim after the plugin has been loaded, from the top of the
+# repository:
+#
+#   vim -N -u NONE -c 'source plugin/dbgpavim.vim' -c 'python import sys; sys.path.insert(0, "plugin")' \
+#       -c 'pyfile plugin/dbgpavim.py' -c 'python dbgPavim_init()' -c 'pyfile bench/bpt_bench.py' -c 'messages'
+
+import time
+
+def legacy_find(self, file, line):
+  """ VimBreakPoint.find() before the index, it scraped :sign place on every call """
+  signs = vim.eval('DbgpavimSigns()')
+  for k in signs.keys():
+    if signs[k][0] == file and signs[k][1] == line:
+      bno = int(k)
+      self.dictionaries[bno]['file'] = file
+      self.dictionaries[bno]['line'] = line
+      return bno
+  return None
+
+def toggle(count):
+  """ set a breakpoint on every other line, then clear them all """
+  start = time.time()
+  for rnd in range(2):
+    for i in range(count):
+      vim.current.window.cursor = (i*2+1, 0)
+      dbgPavim.mark()
+  elapsed = time.time() - start
+  dbgPavim.breakpt.clear()
+  return elapsed
+
+vim.command('silent edit! ' + os.path.join(os.environ.get('TMPDIR', '/tmp'), 'dbgpavim_bpt_bench.php'))
+vim.current.buffer[:] = ['$x = %d;' % i for i in range(2000)]
+indexed = VimBreakPoint.find
+for count in [100, 1000]:
+  VimBreakPoint.find = legacy_find
+  old = toggle(count)
+  VimBreakPoint.find = indexed
+  new = toggle(count)
+  print "%5d breakpoints  legacy %8.3fs  indexed %8.3fs  x%.1f" % (count, old, new, old/new)
+vim.command('bwipeout!')
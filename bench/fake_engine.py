@@ -0,0 +1,264 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# A scriptable stand-in for a DBGp debugger engine such as Xdebug.
+#
+# It connects to the IDE like a debugged script does, sends <init> and
+# answers every command with a <response>: stacks of a configurable depth,
+# contexts and arrays with a configurable number of children (paged by
+# max_children). Replies can be delayed to stand for a slow network; like
+# Xdebug, the engine sets TCP_NODELAY.
+#
+# Run some engines against a listening DBGPavim from the top of the
+# repository:
+#
+#   python bench/fake_engine.py --port 9000 --count 10 --depth 30 --children 1000
+#
+# or use FakeEngine from a benchmark.
+
+import re
+import sys
+import time
+import base64
+import Queue
+import select
+import socket
+import argparse
+from threading import Thread
+
+NS = 'xmlns="urn:debugger_protocol_v1" xmlns:xdebug="http://xdebug.org/dbgp/xdebug"'
+
+def frame(xml):
+  body = '<?xml version="1.0" encoding="iso-8859-1"?>\n' + xml
+  return str(len(body)) + '\0' + body + '\0'
+
+class FakeEngine(Thread):
+  """ one debugged script, talking DBGp to the IDE at host:port
+
+  depth      frames returned by stack_get
+  children   variables returned by context_get, and children of arrays
+  steps      steps and runs before the script ends, None for never
+  latency    seconds between a command arriving and its reply being sent,
+             commands sent in a row are answered in parallel
+  output     lines the script prints on each step, sent as <stream> packets
+             once the IDE asked for copies with stdout -c 1
+  runtime    seconds run takes to reach the next break point, a break
+             command interrupts it earlier """
+  def __init__(self, host = '127.0.0.1', port = 9000, depth = 10, children = 100,
+               steps = None, latency = 0, fileuri = 'file:///var/www/index.php', idekey = 'bench', output = 0, runtime = 0):
+    self.host      = host
+    self.port      = port
+    self.depth     = depth
+    self.children  = children
+    self.steps     = steps
+    self.latency   = latency
+    self.fileuri   = fileuri
+    self.idekey    = idekey
+    self.output    = output
+    self.runtime   = runtime
+    self.running   = None
+    self.streams   = {}
+    self.features  = {'max_children': '32', 'max_depth': '1', 'max_data': '1024'}
+    self.sock      = None
+    self.commands  = 0
+    self.bytesIn   = 0
+    self.bytesOut  = 0
+    self.outbox    = Queue.Queue()
+    Thread.__init__(self)
+    self.daemon    = True
+  def connect(self, sock = None):
+    """ use sock, or connect to the IDE """
+    if sock == None:
+      sock = socket.create_connection((self.host, self.port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.sock = sock
+    self.send('<init %s appid="%d" idekey="%s" session="" thread="" parent="" language="PHP" protocol_version="1.0" fileuri="%s"/>' % \
+        (NS, id(self), self.idekey, self.fileuri))
+  def send(self, xml):
+    data = frame(xml)
+    self.bytesOut += len(data)
+    if self.latency:
+      self.outbox.put((self.arrived + self.latency, data))
+    else:
+      self.sock.sendall(data)
+  def sender(self):
+    """ send the delayed replies when they are due, None ends """
+    while True:
+      item = self.outbox.get()
+      if item == None:
+        break
+      delay = item[0] - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      try:
+        self.sock.sendall(item[1])
+      except socket.error:
+        break
+  def run(self):
+    self.arrived = time.time()
+    if self.latency:
+      sender = Thread(target = self.sender)
+      sender.daemon = True
+      sender.start()
+    if self.sock == None:
+      try:
+        self.connect()
+      except socket.error:
+        return
+    buf = ''
+    done = False
+    while not done:
+      if self.running != None:
+        (readable, writable, errors) = select.select([self.sock], [], [], max(0, self.running[2] - time.time()))
+        if len(readable) == 0:
+          self.arrived = time.time()
+          self.finish()
+          continue
+      try:
+        data = self.sock.recv(65536)
+      except socket.error:
+        break
+      if not data:
+        break
+      self.arrived = time.time()
+      self.bytesIn += len(data)
+      buf += data
+      while '\0' in buf and not done:
+        (line, buf) = buf.split('\0', 1)
+        done = not self.reply(line)
+    if self.latency:
+      self.outbox.put(None)
+      sender.join()
+    self.sock.close()
+  def args(self, line):
+    """ command name, its -x options and the base64 data after -- """
+    data = ''
+    if ' -- ' in line:
+      (line, data) = line.split(' -- ', 1)
+      data = base64.decodestring(data)
+    parts = line.split(' ')
+    opts = {}
+    for (i, p) in enumerate(parts[1:]):
+      if p[:1] == '-' and len(p) == 2:
+        opts[p[1]] = parts[i+2] if i+2 < len(parts) else ''
+    name = re.search(r' -n (.*?)( -[a-z] |$)', line)
+    if name != None:
+      opts['n'] = name.group(1)
+    return (parts[0], opts, data)
+  def reply(self, line):
+    (cmd, opts, data) = self.args(line)
+    tid = opts.get('i', '0')
+    self.commands += 1
+    handler = getattr(self, 'on_' + cmd, None)
+    if handler == None:
+      self.send('<response %s command="%s" transaction_id="%s"><error code="4"><message><![CDATA[unimplemented command]]></message></error></response>' % (NS, cmd, tid))
+      return True
+    return handler(cmd, tid, opts, data)
+  def status(self, cmd, tid, status):
+    self.send('<response %s command="%s" transaction_id="%s" status="%s" reason="ok"/>' % (NS, cmd, tid, status))
+  def on_feature_set(self, cmd, tid, opts, data):
+    self.features[opts.get('n')] = opts.get('v')
+    self.send('<response %s command="%s" transaction_id="%s" feature="%s" success="1"/>' % (NS, cmd, tid, opts.get('n')))
+    return True
+  def on_breakpoint_set(self, cmd, tid, opts, data):
+    self.send('<response %s command="%s" transaction_id="%s" state="enabled" id="%d%s"/>' % (NS, cmd, tid, id(self) % 10000, tid))
+    return True
+  def on_breakpoint_remove(self, cmd, tid, opts, data):
+    self.send('<response %s command="%s" transaction_id="%s"/>' % (NS, cmd, tid))
+    return True
+  def on_stdout(self, cmd, tid, opts, data):
+    self.streams[cmd] = opts.get('c') != '0'
+    self.send('<response %s command="%s" transaction_id="%s" success="1"/>' % (NS, cmd, tid))
+    return True
+  on_stderr = on_stdout
+  def finish(self):
+    """ end the run in progress at a break point """
+    (cmd, tid, due) = self.running
+    self.running = None
+    self.ran(cmd, tid)
+  def on_run(self, cmd, tid, opts, data):
+    if self.runtime and cmd == 'run':
+      self.running = (cmd, tid, time.time() + self.runtime)
+      return True
+    return self.ran(cmd, tid)
+  def ran(self, cmd, tid):
+    if self.steps != None:
+      self.steps -= 1
+    if self.streams.get('stdout'):
+      for i in range(self.output):
+        text = base64.encodestring('line %d of step %d\n' % (i, self.commands)).replace('\n', '')
+        self.send('<stream %s type="stdout" encoding="base64"><![CDATA[%s]]></stream>' % (NS, text))
+    self.status(cmd, tid, 'stopping' if self.steps != None and self.steps < 0 else 'break')
+    return True
+  on_step_into = on_step_over = on_step_out = on_run
+  def on_break(self, cmd, tid, opts, data):
+    if self.running != None:
+      self.finish()
+    self.send('<response %s command="%s" transaction_id="%s" success="1"/>' % (NS, cmd, tid))
+    return True
+  def on_feature_get(self, cmd, tid, opts, data):
+    if opts.get('n') == 'supports_async':
+      value = '1'
+    else:
+      value = self.features.get(opts.get('n'))
+    self.send('<response %s command="%s" transaction_id="%s" feature_name="%s" supported="%d"><![CDATA[%s]]></response>' % \
+        (NS, cmd, tid, opts.get('n'), value != None, value or '0'))
+    return True
+  def on_stop(self, cmd, tid, opts, data):
+    self.status(cmd, tid, 'stopped')
+    return False
+  def on_detach(self, cmd, tid, opts, data):
+    self.status(cmd, tid, 'stopped')
+    return False
+  def on_stack_get(self, cmd, tid, opts, data):
+    frames = ['<stack where="frame%d" level="%d" type="file" filename="file:///var/www/lib/file%d.php" lineno="%d"/>' % (i, i, i, i+10) \
+              for i in range(self.depth)]
+    self.send('<response %s command="%s" transaction_id="%s">%s</response>' % (NS, cmd, tid, ''.join(frames)))
+    return True
+  def scalar(self, name, i):
+    value = base64.encodestring('value of %s %d' % (name, i)).replace('\n', '')
+    return '<property name="%s" fullname="%s" type="string" size="%d" encoding="base64"><![CDATA[%s]]></property>' % \
+        (name, name, len(value), value)
+  def array(self, name, page):
+    """ a property with self.children children, one page of max_children of them """
+    pagesize = int(self.features['max_children'])
+    first = page*pagesize
+    children = [self.scalar('%s[%d]' % (name, i), i) for i in range(first, min(first+pagesize, self.children))]
+    return '<property name="%s" fullname="%s" type="array" children="1" numchildren="%d" page="%d" pagesize="%d">%s</property>' % \
+        (name, name, self.children, page, pagesize, ''.join(children))
+  def on_context_get(self, cmd, tid, opts, data):
+    props = [self.scalar('$v%d' % i, i) for i in range(self.children)]
+    self.send('<response %s command="%s" transaction_id="%s" context="0">%s</response>' % (NS, cmd, tid, ''.join(props)))
+    return True
+  def on_property_get(self, cmd, tid, opts, data):
+    self.send('<response %s command="%s" transaction_id="%s">%s</response>' % (NS, cmd, tid, self.array(opts.get('n', '$x'), int(opts.get('p', '0')))))
+    return True
+  def on_source(self, cmd, tid, opts, data):
+    text = ''.join(['<?php // line %d of %s\n' % (i+1, opts.get('f')) for i in range(self.depth+20)])
+    self.send('<response %s command="%s" transaction_id="%s" success="1" encoding="base64"><![CDATA[%s]]></response>' % \
+        (NS, cmd, tid, base64.encodestring(text).replace('\n', '')))
+    return True
+  def on_eval(self, cmd, tid, opts, data):
+    self.send('<response %s command="%s" transaction_id="%s">%s</response>' % (NS, cmd, tid, self.scalar('', 0)))
+    return True
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Connect fake DBGp engines to a listening IDE.')
+  parser.add_argument('--host', default = '127.0.0.1')
+  parser.add_argument('--port', type = int, default = 9000)
+  parser.add_argument('--count', type = int, default = 1, help = 'engines to connect')
+  parser.add_argument('--depth', type = int, default = 10, help = 'frames returned by stack_get')
+  parser.add_argument('--children', type = int, default = 100, help = 'variables in a context and children of an array')
+  parser.add_argument('--steps', type = int, default = None, help = 'steps before the script ends')
+  parser.add_argument('--latency', type = float, default = 0, help = 'milliseconds before each reply')
+  parser.add_argument('--output', type = int, default = 0, help = 'lines printed on each step')
+  parser.add_argument('--runtime', type = float, default = 0, help = 'milliseconds each run takes without a break')
+  a = parser.parse_args()
+  engines = [FakeEngine(a.host, a.port, a.depth, a.children, a.steps, a.latency/1000.0, output = a.output, runtime = a.runtime/1000.0) for i in range(a.count)]
+  for e in engines:
+    e.start()
+  for e in engines:
+    while e.is_alive():
+      e.join(1)
+    print >>sys.stderr, "engine %d: %d commands, %d bytes in, %d bytes out" % (id(e), e.commands, e.bytesIn, e.bytesOut)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,92 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# Microbenchmark of DbgpFrameReader, and of DbgSession.recv_msg() which adds
+# tracing and statistics on top, against the former byte-at-a-time reader
+# followed by ET.fromstring() over the whole message.
+#
+# It runs without Vim on the client core, from the top of the repository:
+#
+#   python bench/recv_bench.py
+
+import sys
+import socket
+import time
+from threading import Thread
+
+sys.path.insert(0, 'plugin')
+from dbgpcore import *
+
+def legacy_recv_msg(sock):
+  """ the reader DbgSession used before DbgpFrameReader, and its parsing """
+  length = ''
+  while 1:
+    c = sock.recv(1)
+    if c == '\0' or c == '':
+      break
+    if c.isdigit():
+      length = length + c
+  body = ''
+  to_recv = int(length)
+  while to_recv > 0:
+    buf = sock.recv(to_recv)
+    to_recv -= len(buf)
+    body = body + buf
+  while sock.recv(1) != '\0':
+    pass
+  body = body.replace('\n','')
+  body = body.replace('<?xml version="1.0" encoding="iso-8859-1"?>', '<?xml version="1.0" encoding="utf-8"?>', 1)
+  return ET.fromstring(body)
+
+def make_frame(size):
+  body = '<?xml version="1.0" encoding="iso-8859-1"?>\n<response command="context_get" transaction_id="1">' + \
+         'x'*size + '</response>'
+  return str(len(body)) + '\0' + body + '\0'
+
+class Feeder(Thread):
+  def __init__(self, sock, frame, count):
+    self.sock = sock
+    self.frame = frame
+    self.count = count
+    Thread.__init__(self)
+  def run(self):
+    for i in range(self.count):
+      self.sock.sendall(self.frame)
+
+def bench(reader, size, count):
+  (a, b) = socket.socketpair()
+  feeder = Feeder(a, make_frame(size), count)
+  start = time.time()
+  feeder.start()
+  for i in range(count):
+    reader(b)
+  elapsed = time.time() - start
+  feeder.join()
+  a.close()
+  b.close()
+  return elapsed
+
+def frame_reader():
+  """ DbgpFrameReader alone, without the bookkeeping of DbgSession """
+  r = DbgpFrameReader()
+  def read(sock):
+    while 1:
+      msg = r.next_msg()
+      if msg != None:
+        return msg[0]
+      r.fill(sock)
+  return read
+
+def session_reader():
+  ss = DbgSession(None, 'bench')
+  def read(sock):
+    ss.sock = sock
+    return ss.recv_msg()
+  return read
+
+setFrontend(DbgFrontend())
+tracer.configure(DbgTracer.OFF, 0, 0)
+for (size, count) in [(64, 20000), (4096, 5000), (1024*1024, 20), (8*1024*1024, 4)]:
+  old = bench(legacy_recv_msg, size, count)
+  framed = bench(frame_reader(), size, count)
+  new = bench(session_reader(), size, count)
+  print "%9d bytes x %-6d legacy %8.3fs  framed %8.3fs  x%.1f  session %8.3fs  x%.1f" % \
+      (size, count, old, framed, old/framed, new, old/new)
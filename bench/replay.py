@@ -0,0 +1,41 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# Replay the sessions of a recording made with :DbgRecord or
+# dbgpcli.py --record through DbgSession, formatting every property as the
+# watch window would, and report the time spent per command.
+#
+# It runs without Vim on the client core, from the top of the repository:
+#
+#   python bench/replay.py session.jsonl [speed]
+#
+# speed 1 keeps the recorded pace, 0 (the default) replays as fast as
+# possible. :DbgReplay replays a recording through the windows of Vim.
+
+import sys
+
+sys.path.insert(0, 'plugin')
+from dbgpcore import *
+
+class ReplaySession(DbgSession):
+  """ a session formatting the properties of the replies it handles """
+  def __init__(self, address):
+    DbgSession.__init__(self, None, address)
+    self.formatter = PropertyFormatter()
+    self.formatted = 0
+  def handle_dom(self, resDom):
+    start = clock()
+    DbgSession.handle_dom(self, resDom)
+    if resDom.tag == "{urn:debugger_protocol_v1}init":
+      self.formatter.language = self.language
+    elif resDom.get('command') in ('context_get', 'property_get', 'eval'):
+      self.formatted += len(self.formatter.parseResponse(resDom))
+    self.stats.handled(resDom.get('command', 'init'), clock() - start)
+
+setFrontend(DbgFrontend())
+tracer.configure(DbgTracer.OFF, 0, 0)
+rec = DbgReplay(sys.argv[1])
+speed = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+for address in rec.addresses():
+  ss = ReplaySession(address)
+  (frames, elapsed) = rec.replay(ss, address, speed)
+  print "%s: %d frames in %.3fs, %d characters formatted" % (address, frames, elapsed, ss.formatted)
+  print '\n'.join(ss.stats.report())
@@ -0,0 +1,154 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# End-to-end benchmarks of the hot paths against bench/fake_engine.py:
+# session setup, step latency, stepping in the background as with
+# g:dbgPavimAsync, context_get with many children, frame
+# navigation with and without prefetching and the accept throughput of
+# DbgListener.
+#
+# It runs without Vim on the client core, from the top of the repository:
+#
+#   python bench/suite.py
+
+import sys
+import socket
+import time
+
+sys.path.insert(0, 'plugin')
+sys.path.insert(0, 'bench')
+from dbgpcore import *
+from fake_engine import FakeEngine
+
+fe = DbgFrontend()
+setFrontend(fe)
+
+def free_port():
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+def connect(**options):
+  """ a DbgSession set up with a fake engine, and the engine """
+  serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  serv.bind(('127.0.0.1', 0))
+  serv.listen(1)
+  engine = FakeEngine(port = serv.getsockname()[1], **options)
+  engine.start()
+  (sock, address) = serv.accept()
+  serv.close()
+  ss = DbgSession(sock, '%s:%d' % address)
+  ss.sock.settimeout(30)
+  ss.init()
+  return (ss, engine)
+
+def bench_setup():
+  for count in [0, 100, 1000]:
+    fe.breakpt.clear()
+    for i in range(count):
+      fe.breakpt.add('/var/www/lib/file%d.php' % (i % 50), i+1)
+    start = time.time()
+    (ss, engine) = connect()
+    elapsed = time.time() - start
+    ss.s_close()
+    print "setup   %5d breakpoints              %8.3fms" % (count, elapsed*1000)
+  fe.breakpt.clear()
+
+def bench_step():
+  commands = [('step_over',), ('stack_get',), ('context_get', '-d 0'), ('property_get', '-d 0 -n $rows')]
+  for latency in [0, 0.002]:
+    for pipeline in [0, 1]:
+      fe.pipeline = pipeline
+      (ss, engine) = connect(depth = 30, children = 50, latency = latency)
+      start = time.time()
+      for i in range(50):
+        ss.s_commands(commands)
+      elapsed = (time.time() - start)/50
+      ss.s_close()
+      print "step    latency %3dms pipeline %d      %8.3fms" % (latency*1000, pipeline, elapsed*1000)
+
+def bench_async_step():
+  """ a step and the commands after it sent with async_commands, their
+  replies polled as the Vim timer of DBGPavim.poll does every interval ms,
+  against waiting for them """
+  followup = [('stack_get',), ('context_get', '-d 0'), ('property_get', '-d 0 -n $rows')]
+  for latency in [0, 0.002]:
+    for interval in [None, 10, 1]:
+      (ss, engine) = connect(depth = 30, children = 50, latency = latency)
+      start = time.time()
+      for i in range(20):
+        if interval == None:
+          ss.s_commands([('step_over',)])
+          ss.s_commands(followup)
+          continue
+        ss.async_commands([('step_over',)], lambda: ss.async_commands(followup))
+        while len(ss.batches) > 0:
+          time.sleep(interval/1000.0)
+          if ss.readable():
+            ss.poll()
+      elapsed = (time.time() - start)/20
+      ss.s_close()
+      mode = "waiting    " if interval == None else "polled %2dms" % interval
+      print "async   latency %3dms %s     %8.3fms" % (latency*1000, mode, elapsed*1000)
+
+def bench_context():
+  ww = PropertyFormatter()
+  for children in [1000, 100000]:
+    (ss, engine) = connect(children = children)
+    start = time.time()
+    res = ss.s_command('context_get', '-d 0')
+    received = time.time() - start
+    start = time.time()
+    for p in res.findall('{urn:debugger_protocol_v1}property'):
+      ww.parseProperty(p, 0, ww.parseNode1)
+    formatted = time.time() - start
+    ss.s_close()
+    print "context %6d children  recv %8.3fms  format %8.3fms" % (children, received*1000, formatted*1000)
+
+def bench_frames():
+  """ context_get of the frames below the top, as Up/Dn ask for it, after the
+  user read the code for 50ms, with and without prefetching """
+  for prefetch in [0, 1]:
+    (ss, engine) = connect(depth = 10, children = 50, latency = 0.005)
+    elapsed = 0
+    for i in range(10):
+      ss.s_command('step_over')
+      if prefetch:
+        ss.prefetch(range(5))
+      time.sleep(0.05)
+      start = time.time()
+      for level in range(1, 5):
+        ss.s_command('context_get', '-d %d' % level)
+      elapsed += time.time() - start
+    ss.s_close()
+    print "frames  latency   5ms prefetch %d      %8.3fms" % (prefetch, elapsed/40*1000)
+
+def bench_accept():
+  count = 50
+  (breakAtEntry, once) = (fe.breakAtEntry, fe.dbgPavimOnce)
+  (fe.breakAtEntry, fe.dbgPavimOnce) = (1, 0)
+  default = fe.debugListener
+  listener = DbgListener(free_port())
+  fe.debugListener = listener
+  listener.start()
+  while listener.status() != DbgListener.LISTEN:
+    time.sleep(0.01)
+  start = time.time()
+  for i in range(count):
+    FakeEngine(port = listener.port).start()
+  while listener.pendingCount() < count and time.time() - start < 60:
+    time.sleep(0.001)
+  elapsed = time.time() - start
+  ready = listener.pendingCount()
+  listener.stop()
+  fe.debugListener = default
+  (fe.breakAtEntry, fe.dbgPavimOnce) = (breakAtEntry, once)
+  print "accept  %d of %d sessions set up       %8.3fms  %.0f/s" % (ready, count, elapsed*1000, ready/elapsed)
+
+tracer.configure(DbgTracer.OFF, 0, 0)
+bench_setup()
+bench_step()
+bench_async_step()
+bench_context()
+bench_frames()
+bench_accept()
@@ -37,29 +37,106 @@ import os
 import sys
 import vim
 import socket
-import base64
+import difflib
 import traceback
-import xml.etree.ElementTree as ET
+import json
+try:
+  import xml.etree.cElementTree as ET
+except ImportError:
+  import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
 
 import string
 import time, subprocess
-from threading import Thread,Lock
-
-def getFilePath(s):
-  if s[:7] == "file://":
-    fn = s[7:]
-  else:
-    fn = s
-  win = 0
-  if fn[2] == ':':
-    fn = fn[1:]
-    win = 1
-  return [fn, win]
-
-tracelog = open(os.getenv("HOME").replace("\\","/")+"/.dbgpavim.trace",'w')
-def DBGPavimTrace(log):
-  tracelog.write("\n"+log+"\n")
-  tracelog.flush()
+from threading import Thread, current_thread
+
+import dbgpcore
+from dbgpcore import *
+
+class VimBatch(object):
+  """ Vim commands issued while a debugger stop is handled
+
+  Between begin() and end() commands are queued and run in one execute()
+  when the stop has been handled, or before anything is evaluated. Window
+  numbers are looked up once per stop unless the layout changes. """
+  def __init__(self):
+    self.depth     = 0
+    self.pending   = []
+    self.winnrs    = {}
+    self.execute   = None
+    self.calls     = 0
+    self.commands  = 0
+    self.lastCalls = 0
+    self.started   = 0
+    self.stops     = deque(maxlen=1024)
+  def begin(self):
+    if self.depth == 0:
+      self.calls    = 0
+      self.commands = 0
+      self.started  = clock()
+      self.layoutChanged()
+    self.depth += 1
+  def end(self, stop = True):
+    """ run the queued commands, stop tells whether a stop was handled and
+    is counted in the statistics """
+    self.depth -= 1
+    if self.depth == 0:
+      self.flush()
+      self.layoutChanged()
+      if stop:
+        self.lastCalls = self.calls
+        self.stops.append((self.calls, self.commands, clock() - self.started))
+        DBGPavimTrace("Stop handled with %d commands in %d Vim calls" % (self.commands, self.calls))
+  def summary(self):
+    """ Vim calls, commands and milliseconds per stop, as p50/p95/max """
+    result = OrderedDict()
+    for (i, name, scale) in [(0, 'calls', 1), (1, 'commands', 1), (2, 'ms', 1000)]:
+      values = sorted([stop[i] for stop in self.stops])
+      if len(values) == 0:
+        values = [0]
+      result[name] = OrderedDict([('p50', values[len(values)/2]*scale), ('p95', values[int(len(values)*0.95)]*scale), ('max', values[-1]*scale)])
+    result['stops'] = len(self.stops)
+    return result
+  def command(self, cmd):
+    self.commands += 1
+    if self.depth > 0:
+      self.pending.append(cmd)
+    else:
+      self.calls += 1
+      vim.command(cmd)
+  def eval(self, expr):
+    self.flush()
+    self.calls += 1
+    return vim.eval(expr)
+  def flush(self):
+    if len(self.pending) == 0:
+      return
+    (cmds, self.pending) = (self.pending, [])
+    if self.execute == None:
+      self.calls += 1
+      self.execute = vim.eval("exists('*execute')") == '1'
+    if self.execute and len(cmds) > 1:
+      self.calls += 1
+      vim.command('call execute([%s], "")' % ','.join(["'"+c.replace("'", "''")+"'" for c in cmds]))
+    else:
+      for c in cmds:
+        self.calls += 1
+        vim.command(c)
+  def layoutChanged(self):
+    self.winnrs.clear()
+  def winnr(self, name):
+    nr = self.winnrs.get(name)
+    if nr == None:
+      nr = int(self.eval("bufwinnr('"+name+"')"))
+      if nr != -1 and self.depth > 0:
+        self.winnrs[name] = nr
+    return nr
+  def current(self):
+    """ flush the queue before vim.current is looked at """
+    self.flush()
+    return vim.current
+
+vimBatch = VimBatch()
 
 class VimWindow(object):
   """ wrapper class of window of vim """
@@ -71,7 +148,7 @@ class VimWindow(object):
     self.firstwrite = 1
   def isprepared(self):
     """ check window is OK """
-    if self.buffer == None or len(dir(self.buffer)) == 0 or self.getwinnr() == -1:
+    if self.buffer == None or not self.buffer.valid or self.getwinnr() == -1:
       return 0
     return 1
   def prepare(self):
@@ -79,19 +156,18 @@ class VimWindow(object):
     if not self.isprepared():
       self.w_create(self.method)
   def before_create(self):
-    vim.command("1wincmd w")
+    vimBatch.command("1wincmd w")
   def on_create(self):
     self.w_command('setl noswf')
     pass
   def getwinnr(self):
-    return int(vim.eval("bufwinnr('"+self.name+"')"))
+    return vimBatch.winnr(self.name)
   def focus(self):
-    winnr = self.getwinnr()
-    vim.command(str(winnr) + 'wincmd w')
+    vimBatch.command(str(self.getwinnr()) + 'wincmd w')
   def getWidth(self):
-    return int(vim.eval("winwidth(bufwinnr('"+self.name+"'))"))
+    return int(vimBatch.eval("winwidth(bufwinnr('"+self.name+"'))"))
   def getHeight(self):
-    return int(vim.eval("winheight(bufwinnr('"+self.name+"'))"))
+    return int(vimBatch.eval("winheight(bufwinnr('"+self.name+"'))"))
   def write(self, msg, lineno = 0):
     """ append last """
     self.prepare()
@@ -110,18 +186,19 @@ class VimWindow(object):
     """ create window """
     self.method = method
     self.before_create()
-    vim.command('silent ' + method + ' ' + self.name)
-    vim.command("setlocal buftype=nofile")
-    vim.command("setlocal nolist")
-    self.buffer = vim.current.buffer
-    self.width  = int( vim.eval("winwidth(0)")  )
-    self.height = int( vim.eval("winheight(0)") )
+    vimBatch.command('silent ' + method + ' ' + self.name)
+    vimBatch.command("setlocal buftype=nofile")
+    vimBatch.command("setlocal nolist")
+    vimBatch.layoutChanged()
+    self.buffer = vimBatch.current().buffer
+    (self.width, self.height) = [int(n) for n in vimBatch.eval("[winwidth(0), winheight(0)]")]
     self.on_create()
   def w_destroy(self):
     """ destroy window """
-    if self.buffer == None or len(dir(self.buffer)) == 0:
+    if self.buffer == None or not self.buffer.valid:
       return
     self.w_command('bdelete "%s"' % self.name)
+    vimBatch.layoutChanged()
     self.firstwrite = 1
   def clean(self):
     """ clean all datas in buffer """
@@ -131,10 +208,18 @@ class VimWindow(object):
   def w_command(self, cmd):
     """ go to my window & execute command """
     self.prepare()
-    winnr = self.getwinnr()
-    if winnr != int(vim.eval("winnr()")):
-      vim.command(str(winnr) + 'wincmd w')
-    vim.command(cmd)
+    self.focus()
+    vimBatch.command(cmd)
+  def patch(self, start, old, new):
+    """ turn lines old at start into new by changing only the lines that differ,
+    return the indexes in new of the lines changed """
+    changed = []
+    opcodes = difflib.SequenceMatcher(None, old, new, False).get_opcodes()
+    for (tag, i1, i2, j1, j2) in reversed(opcodes):
+      if tag != 'equal':
+        self.buffer[start+i1:start+i2] = new[j1:j2]
+        changed.extend(range(j1, j2))
+    return changed
   def render(self, xml):
     self.write(ET.tostring(xml))
 
@@ -154,84 +239,105 @@ class StackWindow(VimWindow):
           fmark = '()'
         else:
           fmark = ''
-        [fn, win] = getFilePath(node.get('filename'))
-        fn = dbgPavim.localPathOf(fn)
+        (fn, win) = dbgPavim.localFileOf(node.get('filename'))
         lines += str('%-2s %-15s %s:%s\n' % (node.get('level'), wr+fmark, fn, node.get('lineno')))
-    self.write(lines)
+    if dbgPavim.watchDiff and self.firstwrite == 0 and self.isprepared():
+      self.patch(0, self.buffer[:], lines.split('\n'))
+    else:
+      self.clean()
+      self.write(lines)
   def on_create(self):
     super(StackWindow, self).on_create()
-    vim.command('nnoremap <silent> <buffer> <Enter> :call DbgpavimStackWindowOnEnter()<CR>')
-    vim.command('call DbgpavimBindKeys()')
-    vim.command('autocmd BufWinLeave <buffer> python dbgPavim.closeCurrentSession()')
-    vim.command('highlight CurStack term=reverse ctermfg=White ctermbg=Red gui=reverse')
+    vimBatch.command('nnoremap <silent> <buffer> <Enter> :call DbgpavimStackWindowOnEnter()<CR>')
+    vimBatch.command('call DbgpavimBindKeys()')
+    vimBatch.command('autocmd BufWinLeave <buffer> python dbgPavim.closeCurrentSession()')
+    vimBatch.command('highlight CurStack term=reverse ctermfg=White ctermbg=Red gui=reverse')
     self.highlight_stack(0)
   def highlight_stack(self, no):
     self.w_command('syntax clear')
-    vim.command('syntax region CurStack start="^' +str(no)+ ' " end="$"')
+    vimBatch.command('syntax region CurStack start="^' +str(no)+ ' " end="$"')
 
-class WatchWindow(VimWindow):
+class WatchWindow(VimWindow, PropertyFormatter):
   def __init__(self, name = 'WATCH_WINDOW'):
     VimWindow.__init__(self, name)
-  def decode_string(self, msg, encoding):
-    if encoding == 'base64':
-      value = base64.decodestring(msg)
-    elif encoding == '' or encoding == None or encoding == 'None':
-      value = msg
+    self.blocks     = {}
+    self.matchid    = -1
+  def render_page(self, xml, lineno):
+    """ replace the placeholder line at lineno with the page of children in xml """
+    line = self.buffer[lineno-1]
+    del self.buffer[lineno-1]
+    level = len(line)-len(line.lstrip())
+    p = xml.find('{urn:debugger_protocol_v1}property')
+    if p.find('{urn:debugger_protocol_v1}fullname') != None:
+      parser = getattr(self, 'parseNode2')
     else:
-      value = "(e:%s) %s" % (encoding, msg)
-    return value
-  def parseNode1(self, p):
-    fullname = p.get('fullname')
-    if fullname == None:
-      fullname = p.get('name')
-    val = None
-    if p.text != None:
-      val = self.decode_string(p.text, p.get('encoding'))
-    return (fullname, val)
-  def parseNode2(self, p):
-    fullname_node = p.find('{urn:debugger_protocol_v1}fullname')
-    fullname = self.decode_string(fullname_node.text, fullname_node.get('encoding'))
-    value_node = p.find('{urn:debugger_protocol_v1}value')
-    val = None
-    if value_node != None and value_node.text != None:
-      val = self.decode_string(value_node.text, value_node.get('encoding'))
-    return (fullname, val)
-  def parseProperty(self, p, level, parser, command = None):
+      parser = getattr(self, 'parseNode1')
     (fullname, val) = parser(p)
-    if command == 'eval':
-      if self.language == 'php':
-        fullname = "$evalResult" if (fullname == None) else ('$evalResult->%s'%(fullname))
-      else:
-        fullname = "evalResult" if (fullname == None) else ('evalResult->%s'%(fullname))
-    else:
-      fullname = "" if (fullname == None) else fullname
-    tp = p.get('type')
-    children = p.get('children')
     properties = p.findall('{urn:debugger_protocol_v1}property')
-    size = p.get('size')
-    if size == None:
-      size = p.get('numchildren')
-    size = ('[%s]' % (size)) if size != None else ""
-    if val != None:
-      value = "(%s%s) '%s'" % (tp, size, val)
-    elif tp == "null":
-      value = "(null)"
-    else:
-      if tp == "object":
-        tp = tp+"|"+p.get('classname')
-      if children == "1" and len(properties) == 0:
-        value = "(%s%s)+" % (tp, size)
+    out = self.parseChildren(p, properties, level, parser, xml.get('command'), fullname)
+    self.write(out, lineno-1)
+    self.replaced(lineno-1, len(out.split('\n')))
+  def replaced(self, idx, count):
+    """ keep the rendered blocks in step after line idx was replaced by count lines """
+    for block in self.blocks.values():
+      if block[0] > idx:
+        block[0] += count-1
+      elif block[0]+len(block[1]) > idx:
+        block[1] = self.buffer[block[0]:block[0]+len(block[1])+count-1]
+        block[2] = []
+    if len(self.blocks) > 0:
+      self.highlight_changes()
+  def trim(self):
+    """ drop the oldest lines beyond g:dbgPavimWatchHistory """
+    first = 1 if self.buffer[0] == '<?' else 0
+    count = len(self.buffer) - dbgPavim.watchHistory
+    if dbgPavim.watchHistory <= 0 or count <= 0:
+      return
+    del self.buffer[first:first+count]
+    for key in self.blocks.keys():
+      block = self.blocks[key]
+      if block[0] < first+count:
+        del self.blocks[key]
       else:
-        value = "(%s%s)" % (tp, size)
-    out = ('%s%s = %s;' % (" "*level, fullname.ljust(32-level), value))
-    for pp in properties:
-      out += '\n'+self.parseProperty(pp, level+2, parser, command)
-    return out
-  def render(self, xml, lineno = 0):
+        block[0] -= count
+    if len(self.blocks) > 0:
+      self.highlight_changes()
+  def render_block(self, key, out):
+    """ show out in place of the block last rendered for key, only the lines
+    that differ are changed and highlighted """
+    lines = out.split('\n')
+    block = self.blocks.get(key)
+    if block == None or not self.isprepared() or self.buffer[block[0]:block[0]+len(block[1])] != block[1]:
+      self.write(out)
+      self.blocks[key] = [len(self.buffer)-len(lines), lines, []]
+      self.trim()
+      return
+    (start, old, changes) = block
+    block[1] = lines
+    block[2] = self.patch(start, old, lines)
+    for other in self.blocks.values():
+      if other[0] > start:
+        other[0] += len(lines)-len(old)
+    self.highlight_changes()
+  def highlight_changes(self):
+    """ highlight the lines changed by the latest update of each block """
+    lines = []
+    for (start, old, changes) in self.blocks.values():
+      lines.extend([start+i+1 for i in changes])
+    self.prepare()
+    self.focus()
+    if self.matchid != -1:
+      vimBatch.command('silent! call matchdelete(%d)' % self.matchid)
+      self.matchid = -1
+    if len(lines) > 0:
+      pattern = '\\|'.join(['\\%%%dl' % l for l in sorted(lines)])
+      self.matchid = int(vimBatch.eval("matchadd('DbgChanged', '%s')" % pattern))
+  def render(self, xml, lineno = 0, key = None):
     command = xml.get('command')
     level = 0
     out = ""
-    if lineno > 0:
+    expand = lineno > 0
+    if expand:
       line = self.buffer[lineno-1]
       del self.buffer[lineno-1]
       lineno -= 1
@@ -247,7 +353,14 @@ class WatchWindow(VimWindow):
       out += self.parseProperty(p, level, parser, command)
       if lineno == 0:
         out += "\n"
-    self.write(out, lineno)
+    if expand:
+      self.write(out, lineno)
+      self.replaced(lineno, len(out.split('\n')))
+    elif key != None and dbgPavim.watchDiff:
+      self.render_block(key, out)
+    else:
+      self.write(out)
+      self.trim()
   def on_create(self):
     super(WatchWindow, self).on_create()
     self.commenter = '// '
@@ -256,14 +369,14 @@ class WatchWindow(VimWindow):
     elif self.language == 'python':
       self.commenter = '## '
     self.w_command('setl noai nocin')
-    vim.command('setl wrap fdm=manual fmr={{{,}}} ft=%s fdl=1' % self.language)
-    vim.command('inoremap <buffer> <cr> <esc>:python dbgPavim.session_command("watch_execute")<cr>')
-    vim.command('nnoremap <silent> <buffer> <Enter> :call DbgpavimWatchWindowOnEnter()<CR>')
-    vim.command('call DbgpavimBindKeys()')
-    vim.command('autocmd BufWinLeave <buffer> python dbgPavim.closeCurrentSession()')
+    vimBatch.command('setl wrap fdm=manual fmr={{{,}}} ft=%s fdl=1' % self.language)
+    vimBatch.command('inoremap <buffer> <cr> <esc>:python dbgPavim.session_command("watch_execute")<cr>')
+    vimBatch.command('nnoremap <silent> <buffer> <Enter> :call DbgpavimWatchWindowOnEnter()<CR>')
+    vimBatch.command('call DbgpavimBindKeys()')
+    vimBatch.command('autocmd BufWinLeave <buffer> python dbgPavim.closeCurrentSession()')
   def input(self, mode, arg = ''):
     if arg == '%v%':
-      arg = vim.eval('@v')
+      arg = vimBatch.eval('@v')
     self.prepare()
     line = self.buffer[-1]
     if line[:len(mode)+1] == self.commenter+'=> '+mode+':':
@@ -289,7 +402,7 @@ class HelpWindow(VimWindow):
     pass
   def on_create(self):
     super(HelpWindow, self).on_create()
-    if vim.eval('g:dbgPavimLang') == 'cn' :
+    if vimBatch.eval('g:dbgPavimLang') == 'cn' :
       self.write(                                                          \
         '[ Function Keys ]                    | [ Command Mode ]             \n' + \
         '  <F1>   打开帮助窗口                | :Bp [arg] 切换断点[中断条件] \n' + \
@@ -325,17 +438,60 @@ class HelpWindow(VimWindow):
         '  For more instructions and latest version,                         \n' + \
         '               pleae refer to https://github.com/brookhong/DBGPavim \n' + \
         '')
-    vim.command('call DbgpavimBindKeys()')
-    vim.command('1')
+    vimBatch.command('call DbgpavimBindKeys()')
+    vimBatch.command('1')
 
 class ConsoleWindow(VimWindow):
-  def __init__(self, name = 'CONSOLE__WINDOW'):
+  def __init__(self, name = 'CONSOLE__WINDOW', scrollback = 10000):
     VimWindow.__init__(self, name)
+    self.scrollback = scrollback
+    self.scrolled   = True
   def before_create(self):
     pass
+  def output(self, text):
+    """ append text the program wrote, dropping the oldest lines beyond scrollback """
+    self.prepare()
+    lines = text.split('\n')
+    if self.firstwrite == 1:
+      self.firstwrite = 0
+      self.buffer[:] = lines
+    else:
+      # the last line goes on until the program writes a newline
+      self.buffer[-1] = self.buffer[-1] + lines[0]
+      if len(lines) > 1:
+        self.buffer.append(lines[1:])
+    excess = len(self.buffer) - self.scrollback
+    if self.scrollback and excess > 0:
+      del self.buffer[:excess]
+    self.scrolled = False
+
+class SessionsWindow(VimWindow):
+  """ the live and queued sessions, one per line """
+  def __init__(self, name = 'DBGPAVIM_SESSIONS'):
+    VimWindow.__init__(self, name)
   def on_create(self):
-    super(ConsoleWindow, self).on_create()
-    vim.command('setlocal autoread')
+    super(SessionsWindow, self).on_create()
+    for (key, action) in [('<Enter>', 'activate'), ('s', 'step_over'), ('i', 'step_into'), ('r', 'run'), ('d', 'detach')]:
+      vimBatch.command('nnoremap <silent> <buffer> %s :call DbgpavimSessionsWindowKey("%s")<CR>' % (key, action))
+    vimBatch.command('nnoremap <silent> <buffer> u :python dbgPavim.sessions()<CR>')
+  def render(self, current, live, queued):
+    now = time.time()
+    lines = ['  %-21s %-9s %6s %-10s %s' % ('session', 'state', 'age', 'idekey', 'location')]
+    for ss in live + queued:
+      if ss in queued:
+        state = 'queued'
+      elif len(ss.batches) > 0:
+        state = 'running'
+      else:
+        state = ss.status or 'starting'
+      (fn, line, uri) = ss.lastPos
+      lines.append('%s %-21s %-9s %5ds %-10s %s:%s' % ('*' if ss == current else ' ', ss.address, state,
+                                                       now - ss.created, ss.idekey, fn, line))
+    lines.append('')
+    lines.append('<Enter> activate  s step over  i step into  r run  d detach  u update')
+    self.clean()
+    self.write('\n'.join(lines))
+    self.w_command('2')
 
 class DebugUI:
   """ DEBUGUI class """
@@ -350,29 +506,30 @@ class DebugUI:
     self.line           = None
     self.cursign        = None
     self.cliwin         = None
-    self.backup_ssop    = vim.eval('&ssop')
 
   def u_create(self, session):
     """ change mode to debug """
     self.session = session
+    self.backup_ssop    = vimBatch.eval('&ssop')
     self.watchwin       = WatchWindow(session.address+"-WATCH_WINDOW")
     self.stackwin       = StackWindow(session.address+"-STACK_WINDOW")
     self.watchwin.language = session.language
 
-    vim.command('tabnew')                # create srcview window (winnr=1)
-    vim.command('setl nolist')
-    vim.command('let t:dbgpavimDebugging="%s"' % session.address)
+    vimBatch.command('tabnew')                # create srcview window (winnr=1)
+    vimBatch.command('setl nolist')
+    vimBatch.command('let t:dbgpavimDebugging="%s"' % session.address)
+    vimBatch.layoutChanged()
 
     """ create windows """
-    self.totalW = int(vim.eval('winwidth(0)'))
-    self.totalH = int(vim.eval('winheight(0)'))
+    self.totalW = int(vimBatch.eval('winwidth(0)'))
+    self.totalH = int(vimBatch.eval('winheight(0)'))
     self.stackwinHeight = int(self.totalH*self.stackwinRatio)
     self.watchwinWidth = int(self.totalW*self.watchwinRatio)
     self.stackwin.w_create('botright '+str(self.stackwinHeight)+' new')
     if self.cliwin:
       self.cliwin.w_create('vertical new')
     self.watchwin.w_create('vertical belowright '+str(self.watchwinWidth)+' new')
-    vim.command('1wincmd w') # goto srcview window(nr=1, top-left)
+    vimBatch.command('1wincmd w') # goto srcview window(nr=1, top-left)
     self.cursign = '1'
     self.set_highlight()
   def reLayout(self):
@@ -380,31 +537,32 @@ class DebugUI:
       self.stackwin.w_command("resize "+str(self.stackwinHeight))
       self.watchwin.w_command("vertical resize "+str(self.watchwinWidth))
     else:
-      vim.command("wincmd _")
-      vim.command("wincmd |")
+      vimBatch.command("wincmd _")
+      vimBatch.command("wincmd |")
 
   def set_highlight(self):
     """ set vim highlight of debugger sign """
-    vim.command("highlight DbgCurrent term=reverse ctermfg=White ctermbg=Red gui=reverse")
-    vim.command("highlight DbgBreakPt term=reverse ctermfg=White ctermbg=Green gui=reverse")
+    vimBatch.command("highlight DbgCurrent term=reverse ctermfg=White ctermbg=Red gui=reverse")
+    vimBatch.command("highlight DbgBreakPt term=reverse ctermfg=White ctermbg=Green gui=reverse")
 
   def help(self):
-    if vim.eval('exists("t:dbgpavimDebugging")') == '0':
-      vim.command('help')
+    if vimBatch.eval('exists("t:dbgpavimDebugging")') == '0':
+      vimBatch.command('help')
     else:
-      if vim.eval('exists("t:dbgpavimHelp")') == '1':
+      if vimBatch.eval('exists("t:dbgpavimHelp")') == '1':
         self.helpwin.w_destroy()
-        vim.command('unlet t:dbgpavimHelp')
+        vimBatch.command('unlet t:dbgpavimHelp')
       else:
         self.helpwin  = HelpWindow('HELP__WINDOW')
         self.stackwin.focus()
         self.helpwin.w_create('vertical new')
-        vim.command('let t:dbgpavimHelp=1')
+        vimBatch.command('let t:dbgpavimHelp=1')
 
   def update_cli(self):
-    self.cliwin.focus()
-    vim.command('e')
-    vim.command('normal G')
+    """ show the latest output of the program """
+    if not self.cliwin.scrolled:
+      self.cliwin.w_command('normal G')
+      self.cliwin.scrolled = True
 
   def u_destroy(self):
     """ destroy windows """
@@ -412,16 +570,17 @@ class DebugUI:
     self.stackwin.w_destroy()
     if self.cliwin:
       self.cliwin.w_destroy()
-    vim.command('sign unplace 1')
-    vim.command('sign unplace 2')
+    vimBatch.command('sign unplace 1')
+    vimBatch.command('sign unplace 2')
     self.set_highlight()
-    if vim.eval('tabpagenr("$")') == '1':
-      vim.command('unlet t:dbgpavimDebugging')
+    if vimBatch.eval('tabpagenr("$")') == '1':
+      vimBatch.command('unlet t:dbgpavimDebugging')
       dbgPavim.updateStatusLine()
     else:
-      vim.command('tabclose!')
+      vimBatch.command('tabclose!')
+    vimBatch.layoutChanged()
   def go_srcview(self):
-    vim.command('1wincmd w')
+    vimBatch.command('1wincmd w')
   def next_sign(self):
     if self.cursign == '1':
       return '2'
@@ -432,179 +591,20 @@ class DebugUI:
 
     self.file = file
     self.go_srcview()
-    vim.command('silent edit ' + file)
-
-    vim.command('call DbgpavimBindKeys()')
+    # reuses the buffer of file, loaded or shown already
+    vimBatch.command("call DbgpavimSrcView('%s')" % file.replace("'", "''"))
     if line == 0:
       line = 1
     nextsign = self.next_sign()
-    vim.command('sign place ' + nextsign + ' name=current line='+str(line)+' file='+file)
-    vim.command('sign unplace ' + self.cursign)
-    vim.command('sign jump ' + nextsign + ' file='+file)
+    vimBatch.command('sign place ' + nextsign + ' name=current line='+str(line)+' file='+file)
+    vimBatch.command('sign unplace ' + self.cursign)
+    vimBatch.command('sign jump ' + nextsign + ' file='+file)
     self.cursign = nextsign
     if self.cliwin:
       self.update_cli()
 
     self.line    = line
 
-class DbgSession(object):
-  def __init__(self, sock, address):
-    self.latestRes = None
-    self.msgid = 0
-    self.sock = sock
-    self.isWinServer = 0
-    self.bptsetlst  = {}
-    self.bptsetids  = {}
-    self.last_command = 'None'
-    self.address = address
-    self.retries = 0
-    self.closed = False
-    self.silent_commmands = {}
-  def jump(self, fn, line):
-    vim.command("e +"+str(line)+" "+str(fn))
-  def handle_response_breakpoint_set(self, res):
-    """handle <response command=breakpoint_set> tag
-    <responsponse command="breakpoint_set" id="110180001" transaction_id="1"/>"""
-    tid = res.get('transaction_id')
-    if tid != None:
-      tid = int(tid)
-      bno = self.bptsetlst[tid]
-      del self.bptsetlst[tid]
-      self.bptsetids[bno] = res.get('id')
-  def getbid(self, bno):
-    """ get Debug Server's breakpoint numbered with bno """
-    if bno in self.bptsetids:
-      return self.bptsetids[bno]
-    return None
-  def recv_data(self,len):
-    c = self.sock.recv(len)
-    if c == '':
-      self.closed = True
-    return c
-  def recv_length(self):
-    length = ''
-    while 1:
-      c = self.recv_data(1)
-      if c == '\0':
-        break
-      if c.isdigit():
-        length = length + c
-    x = 0
-    try:
-      x = int(length)
-    except ValueError:
-      DBGPavimTrace("ValueError %s" % (length) )
-      self.closed = True
-      x = 0
-    return x
-  def recv_null(self):
-    while 1:
-      c = self.recv_data(1)
-      if c == '\0':
-        return
-  def recv_body(self, to_recv):
-    body = ''
-    while to_recv > 0:
-      buf = self.recv_data(to_recv)
-      to_recv -= len(buf)
-      body = body + buf
-    return body
-  def recv_msg(self):
-    length = self.recv_length()
-    body = None
-    if length:
-      body   = self.recv_body(length)
-      self.recv_null()
-    return body
-  def send_msg(self, cmd):
-    DBGPavimTrace(str(self.msgid)+">"*16+self.address+"\n"+cmd)
-    try:
-      self.sock.send(cmd + '\0')
-    except socket.timeout, e:
-      self.retries = self.retries+1
-    except socket.error, e:
-      DBGPavimTrace("Exception when send_msg %d from %s: %s" % (self.msgid, self.address, e[0]) )
-      self.closed = True
-  def handle_recvd_msg(self, res):
-    DBGPavimTrace(str(self.msgid)+"<"*16+self.address+"\n"+res)
-    try:
-      resDom = ET.fromstring(res)
-      if resDom.tag == "{urn:debugger_protocol_v1}response":
-        if resDom.get('command') == "breakpoint_set":
-          self.handle_response_breakpoint_set(resDom)
-        if resDom.get('command') == "stop":
-          self.s_close()
-      elif resDom.tag == "{urn:debugger_protocol_v1}init":
-        [fn, self.isWinServer] = getFilePath(resDom.get('fileuri'))
-        self.language = resDom.get('language').lower()
-    except:
-      resDom = None
-    return resDom
-  def send_command(self, cmd, arg1 = '', arg2 = ''):
-    self.msgid = self.msgid + 1
-    self.retries = 0
-    line = cmd + ' -i ' + str(self.msgid)
-    if arg1 != '':
-      line = line + ' ' + arg1
-    if arg2 != '':
-      line = line + ' -- ' + base64.encodestring(arg2)[0:-1]
-    self.send_msg(line)
-    return self.msgid
-  def ack_command(self):
-    try:
-      self.latestRes = self.recv_msg()
-      if self.latestRes == None:
-        return None
-      resDom = self.handle_recvd_msg(self.latestRes)
-      if resDom != None:
-        tid = resDom.get('transaction_id')
-        if tid != None and int(tid) != int(self.msgid):
-          DBGPavimTrace("Unexpected msg %s when waiting for msg %d from %s" % (tid, self.msgid, self.address) )
-        if self.retries:
-          DBGPavimTrace("Retried %d times for msg %d from %s" % (self.retries, self.msgid, self.address) )
-      else:
-        DBGPavimTrace("Ignored garbage data from %s" % (self.address) )
-        self.closed = True
-      return resDom
-    except socket.timeout, e:
-      self.retries = self.retries+1
-      return None
-    except socket.error, e:
-      DBGPavimTrace("Exception when recv_msg %d from %s: %s" % (self.msgid, self.address, e[0]) )
-      return None
-  def s_command(self, cmd, arg1 = '', arg2 = '', extra = '0', silent = False):
-    if cmd == 'eval':
-      if self.language == 'php':
-        arg2 = '$evalResult=(%s)' %(arg2)
-      else:
-        arg2 = 'evalResult=(%s)' %(arg2)
-    self.send_command(cmd, arg1, arg2)
-    self.last_command = cmd+'('+arg1+','+arg2+','+extra+')'
-    if silent:
-      self.silent_commmands[self.msgid] = 1
-    return self.ack_command()
-  def getExtra(self):
-    extra = ""
-    if self.last_command != None:
-      t = self.last_command.split(',')
-      extra = t[-1][:-1]
-    return extra
-  def s_close(self):
-    if self.sock:
-      self.sock.close()
-      self.sock = None
-  def init(self):
-    self.ack_command()
-    if not self.closed:
-      for bno in dbgPavim.breakpt.list():
-        fn = dbgPavim.remotePathOf(dbgPavim.breakpt.getfile(bno))
-        msgid = self.send_command('breakpoint_set', \
-                                  '-t line -f ' + fn + ' -n ' + str(dbgPavim.breakpt.getline(bno)) + ' -s enabled', \
-                                  dbgPavim.breakpt.getexp(bno))
-        self.bptsetlst[msgid] = bno
-        self.ack_command()
-    return not self.closed
-
 class DbgSessionWithUI(DbgSession):
   def __init__(self, sock, address):
     self.status     = None
@@ -620,49 +620,81 @@ class DbgSessionWithUI(DbgSession):
     super(DbgSessionWithUI, self).s_close()
     self.ui.u_destroy()
 
+  def busy(self):
+    if len(self.batches) > 0:
+      print "Session is running, use :Bk to break it."
+      return True
+    return False
+  def s_command(self, cmd, arg1 = '', arg2 = '', extra = '0', silent = False):
+    if self.busy():
+      return None
+    return DbgSession.s_command(self, cmd, arg1, arg2, extra, silent)
+  def s_pipeline(self, commands):
+    if self.busy():
+      return []
+    return DbgSession.s_pipeline(self, commands)
+
   def copyFromParent(self, ss):
-    self.latestRes = ss.latestRes
+    self.latestDom = ss.latestDom
+    self.breakDom = ss.breakDom
     self.msgid = ss.msgid
     self.isWinServer = ss.isWinServer
     self.sock = ss.sock
+    self.reader = ss.reader
     self.address = ss.address
     self.language = ss.language
     self.bptsetlst  = ss.bptsetlst
     self.bptsetids  = ss.bptsetids
+    self.sent = ss.sent
+    self.cache = ss.cache
+    self.cachekeys = ss.cachekeys
+    self.fileuri = ss.fileuri
+    self.idekey = ss.idekey
+    self.created = ss.created
+    self.setupTime = ss.setupTime
+    self.stats = ss.stats
+    (fn, win) = dbgPavim.localFileOf(ss.fileuri)
+    self.lastPos = (fn, 1, ss.fileuri)
   def init(self, first_command):
-    self.s_command('feature_set', '-n max_children -v ' + dbgPavim.maxChildren)
-    self.s_command('feature_set', '-n max_data -v ' + dbgPavim.maxData)
-    self.s_command('feature_set', '-n max_depth -v ' + dbgPavim.maxDepth)
-    self.s_command(first_command)
+    commands = [('feature_set', '-n max_children -v ' + dbgPavim.maxChildren),
+                ('feature_set', '-n max_data -v ' + dbgPavim.maxData),
+                ('feature_set', '-n max_depth -v ' + dbgPavim.maxDepth)]
+    if self.ui.cliwin:
+      # copy the output of the program to the console, not all engines support stderr
+      commands += [('stdout', '-c 1', '', '0', True), ('stderr', '-c 1', '', '0', True)]
+    self.s_commands(commands + [(first_command,)])
 
   def restart(self):
-    if vim.eval('exists("t:dbgpavimDebugging")') == '1':
-      vim.command('tabclose')
+    if vimBatch.eval('exists("t:dbgpavimDebugging")') == '1':
+      vimBatch.command('tabclose')
     self.s_start(self.ui.cliwin)
   def s_start(self, cliwin = None):
-    self.sock.settimeout(30)
+    vimBatch.begin()
+    try:
+      self.sock.settimeout(30)
 
-    self.ui.cliwin = cliwin
-    self.ui.u_create(self)
-    if self.bap:
-      self.handle_recvd_msg(self.latestRes)
-      self.init("stack_get")
-    else:
-      self.init("step_into")
+      self.ui.cliwin = cliwin
+      self.ui.u_create(self)
+      if self.bap:
+        self.handle_recvd_msg(self.breakDom if self.breakDom != None else self.latestDom)
+        self.init("stack_get")
+      else:
+        self.init("step_into")
 
-    self.ui.set_srcview(*self.lastPos)
-    if self.language == 'php':
-      self.s_command('property_get', "-d %d -n $_SERVER['REQUEST_URI']" % (self.laststack), silent = True)
-      self.s_command('property_get', "-d %d -n $argv" % (self.laststack), silent = True)
-    self.ui.go_srcview()
-  def handle_recvd_msg(self, txt):
-    # log messages
-    txt = txt.replace('\n','')
-    txt = txt.replace('<?xml version="1.0" encoding="iso-8859-1"?>', '<?xml version="1.0" encoding="utf-8"?>', 1)
-    DBGPavimTrace(str(self.msgid)+"<"*16+self.address+"\n"+txt)
-    resDom = ET.fromstring(txt)
+      self.show(*self.lastPos)
+      if self.language == 'php':
+        self.s_commands([('property_get', "-d %d -n $_SERVER['REQUEST_URI']" % (self.laststack), '', '0', True),
+                         ('property_get', "-d %d -n $argv" % (self.laststack), '', '0', True)])
+      self.ui.go_srcview()
+    finally:
+      vimBatch.end()
+  def handle_recvd_msg(self, resDom):
+    self.handle_dom(resDom)
+    return resDom
+  def handle_dom(self, resDom):
     tag = resDom.tag.replace("{urn:debugger_protocol_v1}","")
     """ call appropraite message handler member function, handle_XXX() """
+    start = clock()
     try:
       handler = getattr(self, 'handle_' + tag)
       handler(resDom)
@@ -671,7 +703,7 @@ class DbgSessionWithUI(DbgSession):
       DBGPavimTrace(str(sys.exc_info()[1]))
       DBGPavimTrace("".join(traceback.format_tb( sys.exc_info()[2])))
     self.ui.go_srcview()
-    return resDom
+    self.stats.handled(resDom.get('command', tag), clock() - start)
   def handle_response(self, res):
     """ call appropraite response message handler member function, handle_response_XXX() """
     errors  = res.find('{urn:debugger_protocol_v1}error')
@@ -709,20 +741,23 @@ class DbgSessionWithUI(DbgSession):
       </copyright>
     </init>"""
 
-    [fn, self.isWinServer] = getFilePath(res.get('fileuri'))
+    self.fileuri = res.get('fileuri')
+    (fn, self.isWinServer) = dbgPavim.localFileOf(self.fileuri)
     self.language = res.get('language').lower()
-    self.lastPos = (dbgPavim.localPathOf(fn), 1)
+    self.lastPos = (fn, 1, self.fileuri)
   def handle_response_error(self, res):
     """ handle <error> tag """
-    DBGPavimTrace(ET.tostring(res))
+    DBGPavimTrace("Error response from %s" % (self.address), ET.tostring(res))
     errors  = res.findall('{urn:debugger_protocol_v1}error')
     tid = int(res.get('transaction_id'))
+    if res.get('command') in ('stdout', 'stderr'):
+      self.not_copied(res)
     if tid in self.silent_commmands:
       del self.silent_commmands[tid]
     else:
       for e in errors:
         error_msg = e.find('{urn:debugger_protocol_v1}message')
-        self.ui.watchwin.write('%s Error when %s (%d): %s' % (self.ui.watchwin.commenter, self.last_command, tid, error_msg.text))
+        self.ui.watchwin.write('%s Error when %s (%d): %s' % (self.ui.watchwin.commenter, self.sent.get(tid, self.last_command), tid, error_msg.text))
 
   def handle_response_stack_get(self, res):
     """handle <response command=stack_get> tag
@@ -743,22 +778,21 @@ class DbgSessionWithUI(DbgSession):
 
       self.stacks    = []
       for s in stacks:
-        [fn, win] = getFilePath(s.get('filename'))
-        fn = dbgPavim.localPathOf(fn)
+        (fn, win) = dbgPavim.localFileOf(s.get('filename'))
         wr = s.get('where')
         if wr == None:
           wr = "{main}"
         self.stacks.append( {'file':  fn, \
+                             'uri':   s.get('filename'), \
                              'line':  int(s.get('lineno')),  \
                              'where': wr,        \
                              'level': int(s.get('level'))
                              } )
 
-      self.ui.stackwin.clean()
       self.ui.stackwin.highlight_stack(self.curstack)
       self.ui.stackwin.render(stacks)
-      self.lastPos = ( self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'] )
-      self.ui.set_srcview( self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'] )
+      self.lastPos = ( self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'], self.stacks[self.curstack]['uri'] )
+      self.show(*self.lastPos)
 
   def handle_response_step_out(self, res):
     """handle <response command=step_out> tag
@@ -788,30 +822,80 @@ class DbgSessionWithUI(DbgSession):
     """handle <response command=run> tag
     <response command="step_over" reason="ok" status="break" transaction_id="1 "/>"""
     self.status = res.get('status')
+  def watchKey(self, res):
+    """ the key of the watch window block updated in place by res, None to append res """
+    if self.getExtra(res) == 'watch':
+      return self.sent.get(int(res.get('transaction_id')))
+    return None
   def handle_response_eval(self, res):
     """handle <response command=eval> tag """
-    self.ui.watchwin.render(res)
+    self.ui.watchwin.render(res, 0, self.watchKey(res))
   def handle_response_property_get(self, res):
     """handle <response command=property_get> tag """
-    lineno = self.getExtra()
-    self.ui.watchwin.render(res, int(lineno))
+    extra = self.getExtra(res)
+    if extra[:5] == 'page:':
+      self.ui.watchwin.render_page(res, int(extra[5:]))
+    elif extra == 'watch':
+      self.ui.watchwin.render(res, 0, self.watchKey(res))
+    else:
+      self.ui.watchwin.render(res, int(extra))
   def handle_response_context_get(self, res):
     """handle <response command=context_get> tag """
-    self.ui.watchwin.render(res)
+    if self.getExtra(res) == 'frame':
+      # the variables of the frame moved to replace those of the previous one
+      self.ui.watchwin.render(res, 0, 'frame')
+    else:
+      self.ui.watchwin.render(res, 0, self.watchKey(res))
   def handle_response_feature_set(self, res):
     """handle <response command=feature_set> tag """
     #self.ui.watchwin.render(res)
+  def handle_response_source(self, res):
+    """handle <response command=source> tag """
+  def handle_response_stdout(self, res):
+    """handle <response command=stdout> tag """
+    if res.get('success') == '0':
+      self.not_copied(res)
+  def handle_response_stderr(self, res):
+    """handle <response command=stderr> tag """
+    if res.get('success') == '0':
+      self.not_copied(res)
+  def not_copied(self, res):
+    """ say in the console that the engine would not copy an output of the program """
+    if self.ui.cliwin:
+      self.ui.cliwin.output("[%s of the program not copied, the debugger engine refused to redirect it]\n" % res.get('command'))
+  def handle_stream(self, res):
+    """handle <stream type="stdout" encoding="base64"> tag, output of the program """
+    if self.ui.cliwin:
+      self.ui.cliwin.output(self.ui.watchwin.decode_string(res.text or '', res.get('encoding')))
   def handle_response_default(self, res):
     """handle <response command=context_get> tag """
     print res.toprettyxml()
   def handle_response_breakpoint_remove(self, res):
     """handle <response command=feature_set> tag """
+  def handle_response_break(self, res):
+    """handle <response command=break> tag, the interrupted command replies on its own """
+
+  def show(self, fn, line, uri = None):
+    """ show fn:line in the source view, from a copy fetched from the
+    debugger engine when fn does not exist here """
+    if uri != None and not os.path.exists(fn):
+      fn = self.source(uri) or fn
+    self.ui.set_srcview(fn, line)
+  def show_stack(self):
+    s = self.stacks[self.curstack]
+    self.show(s['file'], s['line'], s['uri'])
+
+  def show_locals(self):
+    """ show the variables of the current frame, prefetched if g:dbgPavimPrefetchFrames is set """
+    if dbgPavim.prefetchFrames > 0:
+      self.s_command('context_get', '-d %d' % self.curstack, '', 'frame')
 
   def go(self, stack):
     if stack >= 0 and stack <= self.laststack:
       self.curstack = stack
       self.ui.stackwin.highlight_stack(self.curstack)
-      self.ui.set_srcview(self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'])
+      self.show_stack()
+      self.show_locals()
 
   def jump(self, fn, line):
     self.ui.set_srcview(fn, line)
@@ -820,19 +904,21 @@ class DbgSessionWithUI(DbgSession):
     if self.curstack > 0:
       self.curstack -= 1
       self.ui.stackwin.highlight_stack(self.curstack)
-      self.ui.set_srcview(self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'])
+      self.show_stack()
+      self.show_locals()
 
   def down(self):
     if self.curstack < self.laststack:
       self.curstack += 1
       self.ui.stackwin.highlight_stack(self.curstack)
-      self.ui.set_srcview(self.stacks[self.curstack]['file'], self.stacks[self.curstack]['line'])
+      self.show_stack()
+      self.show_locals()
 
   def property_get(self, name):
     if name == '':
-      name = vim.eval('expand("<cword>")')
+      name = vimBatch.eval('expand("<cword>")')
     elif name == '%v%':
-      name = vim.eval('@v')
+      name = vimBatch.eval('@v')
     if name:
       name = string.replace(name,'"','\'')
       if self.language == 'php' and name[0] != '$':
@@ -847,6 +933,12 @@ class DbgSessionWithUI(DbgSession):
       name = "\"" + name +"\""
     self.s_command('property_get', '-d %d -n %s' % (self.curstack,  name), '', str(row))
 
+  def expandPage(self, name, page):
+    (row, col) = vim.current.window.cursor
+    if string.find(name,' ') != -1:
+      name = "\"" + name +"\""
+    self.s_command('property_get', '-d %d -p %d -n %s' % (self.curstack, page, name), '', 'page:%d' % row)
+
   def watch_execute(self):
     """ execute command in watch window """
     (cmd, expr) = self.ui.watchwin.get_command()
@@ -859,255 +951,163 @@ class DbgSessionWithUI(DbgSession):
     else:
       print "no commands", cmd, expr
 
-class DbgSilentClient(Thread):
-  def __init__(self, ss):
-    self.session = ss
-    Thread.__init__(self)
-  def run(self):
-    DBGPavimTrace("DbgSilentClient started %s!" % (self.session.address))
-    self.session.init()
-    if not self.session.closed:
-      self.session.sock.settimeout(1)
-      self.session.send_command('run')
-      count = 600
-      while dbgPavim.running and count > 0 and not self.session.closed:
-        resDom = self.session.ack_command()
-        if resDom != None:
-          status = resDom.get('status')
-          if status == "stopping":
-            self.session.s_command("stop")
-          elif status == "break":
-            dbgPavim.debugListener.newSession(self.session, True)
-          break
-        else:
-          DBGPavimTrace("Invalid responsponse %s!" % (self.session.address))
-        count = count-1
-    DBGPavimTrace("DbgSilentClient stopped %s!" % (self.session.address))
-
-class DbgListener(Thread):
-  (LISTEN,CLOSED) = (0,1)
-  """ DBGp Procotol class """
-  def __init__(self, port):
-    self.port     = port
-    self.session_queue = []
-    self._status  = self.CLOSED
-    self.lock = Lock()
-    Thread.__init__(self)
-  def l_start(self):
-    Thread.start(self)
-    time.sleep(0.1)
-    dbgPavim.updateStatusLine()
-  def pendingCount(self):
-    self.lock.acquire()
-    c = len(self.session_queue)
-    self.lock.release()
-    return c
-  def newSession(self, ss, bap):
-    if not isinstance(ss, DbgSessionWithUI):
-      s = DbgSessionWithUI(None,"")
-      s.copyFromParent(ss)
-      ss = s
-    ss.bap = bap
-    self.lock.acquire()
-    self.session_queue.append(ss)
-    c = str(len(self.session_queue))
-    self.lock.release()
-    dbgPavim.updateStatusLine()
-    if dbgPavim.dbgPavimOnce:
-      self.stop(False)
-    print c+" pending connection(s) to be debug, press "+dbgPavim.dbgPavimKeyRun+" to continue."
-  def nextSession(self):
-    session = None
-    self.lock.acquire()
-    if len(self.session_queue) > 0:
-      session = self.session_queue.pop(0)
-    self.lock.release()
-    print ""
-    return session
-  def stop(self, closeConnection = True):
-    self.lock.acquire()
-    try:
-      if self._status == self.LISTEN:
-        client = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
-        client.connect ( ( '127.0.0.1', self.port ) )
-        client.close()
-    finally:
-      if closeConnection:
-        for s in self.session_queue:
-          s.send_command('detach')
-          s.sock.close()
-        del self.session_queue[:]
-    self._status = self.CLOSED
-    self.lock.release()
-    dbgPavim.updateStatusLine()
-  def status(self):
-    self.lock.acquire()
-    s = self._status
-    self.lock.release()
-    return s
-  def run(self):
-    global dbgPavim
-    self.lock.acquire()
-    serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    serv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    serv.settimeout(None)
-    try:
-      serv.bind(('', self.port))
-    except socket.error, e:
-      print "Can not bind to port "+str(self.port)+', Socket Error '+str(e[0])
-      self.lock.release()
+class DbgReplaySession(DbgSessionWithUI):
+  """ a session fed from a recording, with no debugger engine behind it """
+  def handle_response_stop(self, res):
+    self.status = res.get('status')
+  handle_response_detach = handle_response_stop
+
+class VimBreakPoint(BreakPoint):
+  """ break points following their signs in Vim """
+  def sync(self, file):
+    """ move the breakpoints of file to the lines where their signs are,
+    the signs are fetched only when the buffer changed since last time """
+    (bufnr, tick) = vimBatch.eval("[DbgpavimBufnr('%s'), getbufvar(DbgpavimBufnr('%s'), 'changedtick')]" % ((file.replace("'", "''"),)*2))
+    if int(bufnr) <= 0 or self.ticks.get(file) == tick:
       return
-    print ""
-    serv.listen(5)
-    self._status = self.LISTEN
-    self.lock.release()
-    DBGPavimTrace("DbgListener started at %d!" % (self.port))
-    while 1:
-      (sock, address) = serv.accept()
-      adr = '%s:%d' % (address[0], address[1])
-      DBGPavimTrace('# Connection from %s\n' % adr)
-      s = self.status()
-      if s == self.LISTEN:
-        if dbgPavim.breakAtEntry:
-          ss = DbgSessionWithUI(sock, adr)
-          if DbgSession.init(ss):
-            self.newSession(ss, False)
-        else:
-          client = DbgSilentClient(DbgSession(sock, adr))
-          client.start()
-      else:
-        break
-    serv.close()
-    DBGPavimTrace("DbgListener stopped at %d!" % (self.port))
-
-class BreakPoint:
-  """ Breakpoint class """
-  def __init__(self):
-    """ initalize """
-    self.dictionaries  = {}
-    self.startbno = 10000
-    self.maxbno   = self.startbno
-  def clear(self):
-    """ clear of breakpoint number """
-    self.dictionaries.clear()
-    self.maxbno = self.startbno
-  def add(self, file, line, exp = ''):
-    """ add break point at file:line """
-    self.maxbno = self.maxbno + 1
-    self.dictionaries[self.maxbno] = { 'file':file, 'line':line, 'exp':exp }
-    return self.maxbno
-  def remove(self, bno):
-    """ remove break point numbered with bno """
-    del self.dictionaries[bno]
-  def find(self, file, line):
-    """ find break point and return bno(breakpoint number) """
-    signs = vim.eval('DbgpavimSigns()')
+    self.ticks[file] = tick
+    signs = vimBatch.eval('DbgpavimSigns(%s)' % bufnr)
     for k in signs.keys():
-      if signs[k][0] == file and signs[k][1] == line:
-        bno = int(k)
-        self.dictionaries[bno]['file'] = file
-        self.dictionaries[bno]['line'] = line
-        return bno
-    return None
-  def getfile(self, bno):
-    """ get file name of breakpoint numbered with bno """
-    return self.dictionaries[bno]['file']
-  def getline(self, bno):
-    """ get line number of breakpoint numbered with bno """
-    return self.dictionaries[bno]['line']
-  def getexp(self, bno):
-    """ get expression of breakpoint numbered with bno """
-    return self.dictionaries[bno]['exp']
-  def list(self):
-    """ return list of breakpoint number """
-    return self.dictionaries.keys()
+      self.move(int(k), int(signs[k][1]))
 
 class AsyncRunner(Thread):
-  def __init__(self, cmd, logfile):
+  def __init__(self, cmd):
     self.cmd = cmd
-    self.logfile = logfile
     Thread.__init__(self)
   def run(self):
-    log = open(self.logfile, "w")
-    subprocess.check_call(self.cmd, stdin=None, stdout=log, stderr=log, shell=True)
-    log.close()
-    os.remove(self.logfile)
+    # the output of the program reaches the console through the debugger engine
+    null = open(os.devnull, "w")
+    subprocess.call(self.cmd, stdin=None, stdout=null, stderr=null, shell=True)
+    null.close()
 
-class DBGPavim:
+class DBGPavim(DbgFrontend):
   """ Main DBGPavim class """
   def __init__(self):
     """ initialize DBGPavim """
+    DbgFrontend.__init__(self)
     self.loadSettings()
     self.debugListener = DbgListener(self.port)
-    vim.command('sign unplace *')
+    vimBatch.command('sign unplace *')
 
-    self.normal_statusline = vim.eval('&statusline')
+    self.normal_statusline = vimBatch.eval('&statusline')
     self.statusline="%<%f\ %h%m%r\ %=%-10.(%l,%c%V%)\ %P\ %=%{(g:dbgPavimBreakAtEntry==1)?'bae':'bap'}"
-    self.breakpt    = BreakPoint()
-    self.breakold   = BreakPoint()
+    self.breakpt    = VimBreakPoint()
+    self.breakold   = VimBreakPoint()
     self.watchList  = []
     self.evalList  = []
     self.running   = True
     self.debugSessions = {}
     self.cliwin = None
+    self.logwin = None
+    self.profwin = None
+    self.sesswin = None
+    self.pollTimer = None
+    self.pollInterval = 0
+    self.pollActive = 0
+    self.lastSession = None
+    self.vimThread = current_thread()
+    self.events = deque()
+    self.eventTimer = None
+
+  def adopt(self, ss):
+    if not isinstance(ss, DbgSessionWithUI):
+      s = DbgSessionWithUI(None,"")
+      s.copyFromParent(ss)
+      ss = s
+    return ss
+  def sessionQueued(self, ss, count):
+    if self.fromListener(self.sessionQueued, ss, count):
+      return
+    print str(count)+" pending connection(s) to be debug (set up in %.3fs), press %s to continue." % (ss.setupTime, self.dbgPavimKeyRun)
+  def message(self, text):
+    if self.fromListener(self.message, text):
+      return
+    print text
+  def error(self, text):
+    if self.fromListener(self.error, text):
+      return
+    print text
+  def fromListener(self, method, *args):
+    """ whether the caller runs in another thread than Vim, as DbgListener
+    does, method is then queued to be called with args by handleEvents(),
+    for Vim and vimBatch may only be used from the thread of Vim """
+    if current_thread() is self.vimThread:
+      return False
+    self.events.append((method, args))
+    return True
+  def startEvents(self):
+    if self.eventTimer == None and vimBatch.eval('has("timers")') == '1':
+      self.eventTimer = vimBatch.eval("timer_start(100, 'DbgpavimEvents', {'repeat': -1})")
+  def handleEvents(self):
+    """ handle what DbgListener queued, called by a Vim timer while it runs
+    and before commands """
+    listening = self.debugListener.is_alive()
+    while len(self.events) > 0:
+      (method, args) = self.events.popleft()
+      method(*args)
+    if not listening and self.eventTimer != None:
+      vimBatch.command('call timer_stop(%s)' % self.eventTimer)
+      self.eventTimer = None
 
   def updateStatusLine(self):
-    if vim.eval('exists("t:dbgpavimDebugging")') == '1':
-      sl = self.statusline+"%{'-CONN'}"
+    if self.fromListener(self.updateStatusLine):
+      return
+    if vimBatch.eval('exists("t:dbgpavimDebugging")') == '1':
+      ss = self.getCurrentSession()
+      if ss and len(ss.batches) > 0:
+        sl = self.statusline+"%{'-RUN'}"
+      else:
+        sl = self.statusline+"%{'-CONN'}"
     else:
       status = self.debugListener.status()
       c = self.debugListener.pendingCount()
+      a = self.admission
+      counts = "-A%d-R%d" % (a.accepted, a.rejected) if a.accepted + a.rejected > 0 else ""
       if c > 0:
-        sl = self.statusline+"%{'-PEND-"+str(c)+"'}"
+        sl = self.statusline+"%{'-PEND-"+str(c)+counts+"'}"
       elif status == DbgListener.LISTEN:
-        sl = self.statusline+"%{'-LISN-"+str(self.port)+"'}"
+        sl = self.statusline+"%{'-LISN-"+str(self.port)+counts+"'}"
       else:
         sl = self.normal_statusline
-    vim.command("let &statusline=\""+sl+"\"")
+    vimBatch.command("let &statusline=\""+sl+"\"")
 
   def loadSettings(self):
-    self.port = int(vim.eval('g:dbgPavimPort'))
-    self.dbgPavimKeyRun = vim.eval('g:dbgPavimKeyRun')
-    self.maxChildren = vim.eval('g:dbgPavimMaxChildren')
-    self.maxData = vim.eval('g:dbgPavimMaxData')
-    self.maxDepth = vim.eval('g:dbgPavimMaxDepth')
-    self.breakAtEntry = int(vim.eval('g:dbgPavimBreakAtEntry'))
-    self.showContext = int(vim.eval('g:dbgPavimShowContext'))
-    self.pathMap = vim.eval('g:dbgPavimPathMap')
-    self.dbgPavimOnce = int(vim.eval('g:dbgPavimOnce'))
+    self.port = int(vimBatch.eval('g:dbgPavimPort'))
+    self.dbgPavimKeyRun = vimBatch.eval('g:dbgPavimKeyRun')
+    self.maxChildren = vimBatch.eval('g:dbgPavimMaxChildren')
+    self.maxData = vimBatch.eval('g:dbgPavimMaxData')
+    self.maxDepth = vimBatch.eval('g:dbgPavimMaxDepth')
+    self.breakAtEntry = int(vimBatch.eval('g:dbgPavimBreakAtEntry'))
+    self.showContext = int(vimBatch.eval('g:dbgPavimShowContext'))
+    self.pathMap = vimBatch.eval('g:dbgPavimPathMap')
+    self.dbgPavimOnce = int(vimBatch.eval('g:dbgPavimOnce'))
+    self.pipeline = int(vimBatch.eval('g:dbgPavimPipeline'))
+    self.asyncMode = int(vimBatch.eval('g:dbgPavimAsync')) and vimBatch.eval('has("timers")') == '1'
+    self.cacheSize = int(vimBatch.eval('g:dbgPavimCacheSize'))
+    self.watchDiff = int(vimBatch.eval('g:dbgPavimWatchDiff'))
+    self.watchHistory = int(vimBatch.eval('g:dbgPavimWatchHistory'))
+    self.consoleLines = int(vimBatch.eval('g:dbgPavimConsoleLines'))
+    self.fetchSource = int(vimBatch.eval('g:dbgPavimFetchSource'))
+    self.sources.ttl = int(vimBatch.eval('g:dbgPavimSourceTTL'))
+    self.profileInterval = int(vimBatch.eval('g:dbgPavimProfileInterval'))
+    self.prefetchFrames = int(vimBatch.eval('g:dbgPavimPrefetchFrames'))
+    self.admission.configure(int(vimBatch.eval('g:dbgPavimMaxQueue')), float(vimBatch.eval('g:dbgPavimMaxWait')),
+                             vimBatch.eval('g:dbgPavimInclude'), vimBatch.eval('g:dbgPavimExclude'))
+    tracer.configure(int(vimBatch.eval('g:dbgPavimTraceLevel')), int(vimBatch.eval('g:dbgPavimTraceSize')), int(vimBatch.eval('g:dbgPavimTraceTruncate')))
     for m in self.pathMap:
       m[0] = m[0].replace("\\","/")
       m[1] = m[1].replace("\\","/")
-  def remotePathOf(self,lpath):
-    for m in self.pathMap:
-      l = len(m[0])
-      if l and lpath[0:l] == m[0]:
-        return m[1]+lpath[l:]
-    fn = lpath
-    if fn[:7] != "file://":
-      fn = fn.replace("\\","/")
-      if fn[1] == ':':
-        fn = "file:///"+fn
-      else:
-        fn = "file://"+fn
-      lpath = fn
-    return lpath
-  def localPathOf(self,rpath):
-    for m in self.pathMap:
-      l = len(m[1])
-      if l and rpath[0:l] == m[1]:
-        return m[0]+rpath[l:]
-    return rpath
+    self.paths = PathMap(self.pathMap)
   def setMaxChildren(self):
-    self.maxChildren = vim.eval('g:dbgPavimMaxChildren')
+    self.maxChildren = vimBatch.eval('g:dbgPavimMaxChildren')
     for k in self.debugSessions.keys():
       self.debugSessions[k].s_command('feature_set', '-n max_children -v ' + self.maxChildren)
   def setMaxDepth(self):
-    self.maxDepth = vim.eval('g:dbgPavimMaxDepth')
+    self.maxDepth = vimBatch.eval('g:dbgPavimMaxDepth')
     for k in self.debugSessions.keys():
       self.debugSessions[k].s_command('feature_set', '-n max_depth -v ' + self.maxDepth)
   def setMaxData(self):
-    self.maxData = vim.eval('g:dbgPavimMaxData')
+    self.maxData = vimBatch.eval('g:dbgPavimMaxData')
     for k in self.debugSessions.keys():
       self.debugSessions[k].s_command('feature_set', '-n max_data -v ' + self.maxData)
   def handle_exception(self, currentSession):
@@ -1120,15 +1120,20 @@ class DBGPavim:
       if session != None:
         print "socket timeout, switch to another session."
         ss = DbgSession(currentSession.sock, currentSession.address)
-        ss.latestRes = currentSession.latestRes
-        client = DbgSilentClient(ss)
-        client.start()
+        ss.latestDom = currentSession.latestDom
+        ss.reader = currentSession.reader
+        ss.language = currentSession.language
+        ss.fileuri = currentSession.fileuri
+        ss.prefetching = currentSession.prefetching
+        self.debugListener.resume(ss)
         del self.debugSessions[currentSession.address]
         self.debugSessions[session.address] = session
         session.s_start()
       else:
         print "socket timeout, try again or press F6 to stop debugging."
     else: #errno == socket.error:
+      DBGPavimTrace("Path map: %s" % self.paths.stats())
+      self.lastSession = currentSession
       del self.debugSessions[currentSession.address]
       currentSession.s_close()
       if session != None:
@@ -1138,12 +1143,68 @@ class DBGPavim:
 
   def getCurrentSession(self):
     ss = None
-    if vim.eval('exists("t:dbgpavimDebugging")') == '1':
-      k = vim.eval('t:dbgpavimDebugging')
+    if vimBatch.eval('exists("t:dbgpavimDebugging")') == '1':
+      k = vimBatch.eval('t:dbgpavimDebugging')
       if k in self.debugSessions:
         ss = self.debugSessions[k]
     return ss
 
+  def inTab(self, ss, method, *args):
+    """ call method with the tab debugging ss as the current tab, its windows
+    are looked up there, and come back """
+    tab = int(vimBatch.eval("DbgpavimTabOf('%s')" % ss.address))
+    if tab == 0 or tab == int(vimBatch.eval('tabpagenr()')):
+      return method(*args)
+    vimBatch.command('call DbgpavimEnterTab(%d)' % tab)
+    vimBatch.layoutChanged()
+    try:
+      return method(*args)
+    finally:
+      vimBatch.command('call DbgpavimLeaveTab()')
+      vimBatch.layoutChanged()
+  def sessions(self):
+    """ list the live and queued sessions in the sessions window """
+    if self.sesswin == None:
+      self.sesswin = SessionsWindow()
+    live = sorted(self.debugSessions.values(), key=lambda ss: ss.created)
+    self.sesswin.render(self.getCurrentSession(), live, self.debugListener.queued())
+  def sessionAction(self, action, address):
+    """ activate, step, run or detach the session of address, live or queued """
+    try:
+      ss = self.debugSessions.get(address)
+      if ss == None:
+        ss = self.debugListener.take(address)
+        if ss == None:
+          print 'No session %s any more.' % address
+        elif action == 'detach':
+          ss.send_command('detach')
+          DbgSession.s_close(ss)
+        else:
+          self.debugSessions[ss.address] = ss
+          ss.s_start()
+          if action != 'activate':
+            self.sessionAction(action, address)
+          return
+      elif action == 'activate':
+        tab = int(vimBatch.eval("DbgpavimTabOf('%s')" % ss.address))
+        if tab != 0:
+          vimBatch.command('tabnext %d' % tab)
+        return
+      elif action == 'detach':
+        self.lastSession = ss
+        del self.debugSessions[ss.address]
+        ss.send_command('detach')
+        self.inTab(ss, ss.s_close)
+      elif action == 'run':
+        self.inTab(ss, self.s_batch, ss, [('run',)], lambda: self.inTab(ss, self.after_run, ss))
+      else:
+        self.inTab(ss, self.s_batch, ss, [(action,)], lambda: self.inTab(ss, self.after_step, ss))
+    except:
+      self.handle_exception(ss)
+    if self.sesswin != None and self.sesswin.isprepared():
+      self.sessions()
+    self.updateStatusLine()
+
   def session_command(self, *args):
     ss = self.getCurrentSession()
     if ss:
@@ -1153,25 +1214,110 @@ class DBGPavim:
         handler = getattr(ss.ui, args[0])
       handler(*args[1:])
 
+  def s_batch(self, ss, commands, callback = None):
+    """ run commands on ss, in the background if g:dbgPavimAsync is set """
+    if self.asyncMode:
+      if not ss.busy():
+        ss.async_commands(commands, callback)
+        self.startPolling()
+    else:
+      vimBatch.begin()
+      try:
+        ss.s_commands(commands)
+        if callback != None:
+          callback()
+      finally:
+        vimBatch.end()
+  def startPolling(self, interval = 1):
+    """ poll the sessions every interval ms, often while replies are due
+    soon, as after commands were just sent """
+    if interval == 1:
+      self.pollActive = clock()
+    if self.pollTimer != None and self.pollInterval == interval:
+      return
+    stopped = self.pollTimer == None
+    if not stopped:
+      vimBatch.command('call timer_stop(%s)' % self.pollTimer)
+    self.pollTimer = vimBatch.eval("timer_start(%d, 'DbgpavimPoll', {'repeat': -1})" % interval)
+    self.pollInterval = interval
+    if stopped:
+      self.updateStatusLine()
+  def poll(self):
+    """ called by a Vim timer while any session waits for replies, whichever
+    tab it is debugged in. Sessions with nothing to read are skipped without
+    looking at their tab, and once no reply came for 100ms the timer slows
+    down to every 10ms, as the program is running. """
+    self.handleEvents()
+    for ss in self.debugSessions.values():
+      if len(ss.batches) == 0 or not ss.readable():
+        continue
+      self.pollActive = clock()
+      vimBatch.begin()
+      try:
+        received = self.inTab(ss, ss.poll)
+      except:
+        received = 1
+        self.inTab(ss, self.handle_exception, ss)
+      # only the ticks which handled replies count as stops
+      vimBatch.end(received > 0)
+    for k in self.debugSessions.keys():
+      if len(self.debugSessions[k].batches) > 0:
+        if self.pollInterval == 1 and clock() - self.pollActive > 0.1:
+          self.startPolling(10)
+        return
+    vimBatch.command('call timer_stop(%s)' % self.pollTimer)
+    self.pollTimer = None
+    self.updateStatusLine()
+  def interrupt(self):
+    ss = self.getCurrentSession()
+    if ss and len(ss.batches) > 0:
+      ss.queue_command('break')
+    else:
+      print 'No running debug session.'
+
   def step(self):
     ss = self.getCurrentSession()
     if ss:
-      ss.s_command('stack_get')
-      if self.showContext:
-        ss.s_command('context_get', ('-d %d' % ss.curstack))
-      for var in self.watchList:
-        ss.s_command('property_get', "-d %d -n %s" % (ss.curstack, var))
-      for expr in self.evalList:
-        ss.s_command('eval', '', expr)
+      self.s_batch(ss, self.step_commands(), lambda: self.prefetch(ss))
+  def step_commands(self):
+    # stack_get resets the current stack to the top frame
+    commands = [('stack_get',)]
+    if self.showContext:
+      commands.append(('context_get', '-d 0', '', 'watch'))
+    for var in self.watchList:
+      commands.append(('property_get', "-d 0 -n %s" % (var), '', 'watch'))
+    for expr in self.evalList:
+      commands.append(('eval', '', expr, 'watch'))
+    return commands
+  def prefetch(self, ss):
+    """ fetch the variables of the top g:dbgPavimPrefetchFrames frames in the
+    background while the code is read, for Up and Dn to show at once """
+    if self.prefetchFrames > 0 and ss.status == 'break' and not ss.closed:
+      ss.prefetch(range(min(self.prefetchFrames, ss.laststack+1)))
+  def after_step(self, ss):
+    if ss.status == 'break':
+      # stepping onto a logpoint logs it, but stops as asked
+      ss.logAtBreak()
+    if ss.status != 'stopping':
+      self.s_batch(ss, self.step_commands(), lambda: self.prefetch(ss))
+    else:
+      self.s_batch(ss, [('stop',)])
+  def after_run(self, ss):
+    # logpoints never stop the program, in the debugged session either
+    while ss.status == 'break' and ss.logAtBreak():
+      if self.asyncMode:
+        self.s_batch(ss, [('run',)], lambda: self.after_run(ss))
+        return
+      ss.s_command('run')
+    if ss.status == 'stopping':
+      self.s_batch(ss, [('stop',)])
+    elif ss.status != 'stopped':
+      self.s_batch(ss, self.step_commands(), lambda: self.prefetch(ss))
   def d_command(self, msg, arg1 = '', arg2 = ''):
     try:
       ss = self.getCurrentSession()
       if ss:
-        ss.s_command(msg, arg1, arg2)
-        if ss.status != 'stopping':
-          self.step()
-        else:
-          ss.s_command('stop')
+        self.s_batch(ss, [(msg, arg1, arg2)], lambda: self.after_step(ss))
       else:
         print 'No debug session started.'
     except:
@@ -1200,6 +1346,104 @@ class DBGPavim:
         self.evalList.remove(name)
       else:
         self.evalList.append(name)
+  def stats(self, path = ''):
+    """ show the statistics of the current (or latest) session, or dump them as JSON to path """
+    ss = self.getCurrentSession()
+    if ss == None:
+      ss = self.lastSession
+    if ss == None:
+      print 'No debug session started.'
+      return
+    result = OrderedDict()
+    result['session'] = ss.address
+    result['setupTime'] = ss.setupTime
+    result['commands'] = ss.stats.summary()
+    result['propertyCache'] = OrderedDict([('hits', ss.cache.hits), ('misses', ss.cache.misses),
+                                           ('entries', len(ss.cache.entries)), ('bytes', ss.cache.size)])
+    result['pathMap'] = OrderedDict([('hits', self.paths.hits), ('misses', self.paths.misses)])
+    result['prefetch'] = OrderedDict([('frames', self.prefetchFrames), ('inFlight', len(ss.prefetching))])
+    result['sources'] = OrderedDict([('hits', self.sources.hits), ('fetches', self.sources.fetches)])
+    result['admission'] = OrderedDict([('accepted', self.admission.accepted), ('rejected', self.admission.reasons)])
+    result['vim'] = vimBatch.summary()
+    if path != '':
+      f = open(os.path.expanduser(path), 'w')
+      json.dump(result, f, indent=2)
+      f.close()
+      print 'Statistics of %s written to %s' % (ss.address, path)
+      return
+    print 'Session %s, set up in %.3fs' % (ss.address, ss.setupTime or 0)
+    for line in ss.stats.report():
+      print line
+    print 'Property cache: ' + ss.cache.stats()
+    print 'Path map: ' + self.paths.stats()
+    print 'Remote sources: ' + self.sources.stats()
+    print 'Connections: ' + self.admission.stats()
+    v = result['vim']
+    print 'Vim per stop (p50/p95/max): %d/%d/%d calls, %d/%d/%d commands, %.1f/%.1f/%.1f ms in %d stops' % \
+        tuple([v[k][p] for k in ('calls', 'commands', 'ms') for p in ('p50', 'p95', 'max')] + [v['stops']])
+  def record(self, path = ''):
+    """ record the frames of all sessions to path, stop recording without path """
+    if path == '':
+      if recorder.active:
+        recorder.stop()
+        print '%d frames recorded to %s' % (recorder.frames, recorder.path)
+      else:
+        print 'Not recording.'
+      return
+    recorder.start(os.path.expanduser(path))
+    print 'Recording to %s, :DbgRecord without file to stop.' % path
+  def replay(self, path, speed = '0'):
+    """ replay the first session recorded in path in a new tab, at speed
+    times the recorded pace or as fast as possible with 0 """
+    rec = DbgReplay(os.path.expanduser(path))
+    addresses = rec.addresses()
+    if len(addresses) == 0:
+      print 'No session recorded in %s.' % path
+      return
+    ss = DbgReplaySession(None, 'replay-' + addresses[0])
+    ss.bap = False
+    vimBatch.begin()
+    try:
+      ss.handle_init(rec.init(addresses[0]))
+      ss.ui.u_create(ss)
+      (frames, elapsed) = rec.replay(ss, addresses[0], float(speed))
+      ss.ui.go_srcview()
+    finally:
+      vimBatch.end()
+    self.lastSession = ss
+    print 'Replayed %d frames of %s in %.3fs, :DbgStats shows the details.' % (frames, addresses[0], elapsed)
+  def profile(self, seconds = '10', path = ''):
+    """ sample the stack of the current session for seconds, write the samples
+    in the collapsed format of flamegraph.pl to path and show the top functions """
+    ss = self.getCurrentSession()
+    if ss == None:
+      print 'No debug session started.'
+      return
+    if ss.busy():
+      return
+    prof = DbgProfiler(ss.headless(), self.profileInterval/1000.0)
+    if not prof.supported():
+      ss.msgid = prof.session.msgid
+      print 'The debugger engine of %s cannot break a running program.' % ss.address
+      return
+    print 'Profiling %s for %ss, press Ctrl-C to stop.' % (ss.address, seconds)
+    vim.command('redraw')
+    status = prof.run(float(seconds))
+    ss.msgid = prof.session.msgid
+    path = os.path.expanduser(path or '~/.dbgpavim.profile')
+    prof.write(path)
+    if self.profwin == None:
+      self.profwin = VimWindow('DBGPAVIM_PROFILE')
+    self.profwin.clean()
+    self.profwin.write('\n'.join([prof.summary(), 'Samples written to ' + path, ''] + prof.top()))
+    self.profwin.w_command('normal gg')
+    print prof.summary()
+    if prof.session.closed:
+      self.closeCurrentSession()
+      return
+    ss.status = status
+    self.after_run(ss)
+
   def listWatch(self):
     if self.showContext:
       print '*CONTEXT*'
@@ -1210,14 +1454,11 @@ class DBGPavim:
 
   def run(self):
     """ start debugger or continue """
+    self.handleEvents()
     try:
       ss = self.getCurrentSession()
       if ss:
-        ss.s_command('run')
-        if ss.status == 'stopping':
-          ss.s_command("stop")
-        elif ss.status != 'stopped':
-          self.step()
+        self.s_batch(ss, [('run',)], lambda: self.after_run(ss))
       else:
         lstatus = self.debugListener.status()
         ss = self.debugListener.nextSession()
@@ -1230,48 +1471,56 @@ class DBGPavim:
           self.loadSettings()
           self.debugListener = DbgListener(self.port)
           self.debugListener.l_start()
+          self.startEvents()
     except:
       self.handle_exception(ss)
 
   def cli(self, args=""):
-    vim.command("let g:dbgPavimBreakAtEntry=1")
-    filetype = vim.eval('&filetype')
-    filename = vim.eval('expand("%")')
+    vimBatch.command("let g:dbgPavimBreakAtEntry=1")
+    filetype = vimBatch.eval('&filetype')
+    filename = vimBatch.eval('expand("%")')
     if filename:
       cmd = ' '+filename+' '+args
       if filetype == 'php':
-        if vim.eval('DbgpavimCheckXdebug()') == '0':
+        if vimBatch.eval('DbgpavimCheckXdebug()') == '0':
           cmd = 'php -dxdebug.remote_autostart=1 -dxdebug.remote_port='+str(self.port)+cmd
       elif filetype == 'python':
-        if vim.eval('DbgpavimCheckPydbgp()') == '0':
+        if vimBatch.eval('DbgpavimCheckPydbgp()') == '0':
           cmd = 'pydbgp -u -d '+str(self.port)+cmd
       else:
         print "Only python and php file debugging are integrated for now."
       if cmd[0] != ' ':
-        clilog = os.getenv("HOME").replace("\\","/")+"/.dbgpavim.cli"
-        self.cliwin = ConsoleWindow(clilog)
+        self.cliwin = ConsoleWindow(scrollback = self.consoleLines)
         self.run()
         self.dp = True
-        ar = AsyncRunner(cmd, clilog)
+        ar = AsyncRunner(cmd)
         ar.start()
         time.sleep(0.4)
-        #vim.eval('feedkeys("\\'+self.dbgPavimKeyRun+'")')
+        #vimBatch.eval('feedkeys("\\'+self.dbgPavimKeyRun+'")')
     else:
       print "You need open one python or php file first."
 
   def list(self):
-    vim.command("lgetexpr []")
+    vimBatch.command("lgetexpr []")
     inCount = 0
     for bno in self.breakpt.list():
       inCount = inCount + 1
+      notes = []
       if self.breakpt.getexp(bno) != '':
-        vim.command("lad '"+"\|condition: "+self.breakpt.getexp(bno)+" \| "+self.breakpt.getfile(bno)+":"+str(self.breakpt.getline(bno))+":1'")
+        notes.append("condition: "+self.breakpt.getexp(bno))
+      options = self.breakpt.getoptions(bno)
+      if options['hits']:
+        notes.append("hits %s %d" % (options['hitcond'], options['hits']))
+      if options['log']:
+        notes.append("log: "+"; ".join(options['log']))
+      if len(notes) > 0:
+        vimBatch.command("lad '"+"\|"+", ".join(notes)+" \| "+self.breakpt.getfile(bno)+":"+str(self.breakpt.getline(bno))+":1'")
       else:
-        vim.command("lad '"+self.breakpt.getfile(bno)+":"+str(self.breakpt.getline(bno))+":1'")
-    vim.command("lw")
+        vimBatch.command("lad '"+self.breakpt.getfile(bno)+":"+str(self.breakpt.getline(bno))+":1'")
+    vimBatch.command("lw")
     if inCount > 0 :
-      vim.command("wincmd j")
-      vim.command("resize 10")
+      vimBatch.command("wincmd j")
+      vimBatch.command("resize 10")
 
   def removeBreakPoint(self, bno):
     ss = self.getCurrentSession()
@@ -1283,51 +1532,74 @@ class DBGPavim:
   def setBreakPoint(self, bno):
     ss = self.getCurrentSession()
     if ss:
-      fn = dbgPavim.remotePathOf(self.breakpt.getfile(bno))
-      msgid = ss.send_command('breakpoint_set', \
-                                '-t line -f ' + fn + ' -n ' + str(self.breakpt.getline(bno)), \
-                                self.breakpt.getexp(bno))
-      ss.bptsetlst[msgid] = bno
-      ss.ack_command()
+      ss.collect_replies([ss.send_breakpoint(bno)])
+  def sessionBusy(self):
+    """ whether the current session is running, breakpoints are not changed
+    then, or Vim and the debugger engine would disagree about them """
+    ss = self.getCurrentSession()
+    return ss != None and ss.busy()
 
   def clear(self):
+    if self.sessionBusy():
+      return
     for bno in self.breakpt.list():
-      self.breakold.add(self.breakpt.getfile(bno), self.breakpt.getline(bno), self.breakpt.getexp(bno))
-      vim.command('sign unplace ' + str(bno))
+      self.breakold.add(self.breakpt.getfile(bno), self.breakpt.getline(bno), self.breakpt.getexp(bno), **self.breakpt.getoptions(bno))
+      vimBatch.command('sign unplace ' + str(bno))
       self.removeBreakPoint(bno)
       self.breakpt.remove(bno)
 
   def unclear(self):
+    if self.sessionBusy():
+      return
     for bno in self.breakold.list():
       row = self.breakold.getline(bno)
       file = self.breakold.getfile(bno)
       exp = self.breakold.getexp(bno)
+      options = self.breakold.getoptions(bno)
       self.breakold.remove(bno)
       inbno = self.breakpt.find(file, str(row))
       if inbno == None:
-        inbno = self.breakpt.add(file, row, exp)
-        vim.command('sign place ' + str(inbno) + ' name=breakpt line=' + str(row) + ' file=' + file)
+        inbno = self.breakpt.add(file, row, exp, **options)
+        vimBatch.command('sign place ' + str(inbno) + ' name=breakpt line=' + str(row) + ' file=' + file)
         self.setBreakPoint(inbno)
 
-  def mark(self, exp = ''):
+  def mark(self, exp = '', hits = 0, hitcond = '>=', log = None):
     (row, col) = vim.current.window.cursor
     file       = vim.current.buffer.name
 
-    if file:
+    if file and not self.sessionBusy():
       bno = self.breakpt.find(file, str(row))
-      ss = self.getCurrentSession()
       if bno != None:
         self.breakpt.remove(bno)
-        vim.command('sign unplace ' + str(bno))
+        vimBatch.command('sign unplace ' + str(bno))
         self.removeBreakPoint(bno)
       else:
-        bno = self.breakpt.add(file, row, exp)
-        vim.command('sign place ' + str(bno) + ' name=breakpt line=' + str(row) + ' file=' + file)
+        bno = self.breakpt.add(file, row, exp, hits, hitcond, log)
+        vimBatch.command('sign place ' + str(bno) + ' name=breakpt line=' + str(row) + ' file=' + file)
         self.setBreakPoint(bno)
+  def markHits(self, hits, hitcond = '>='):
+    """ toggle a breakpoint breaking only when its hit count compared with hitcond matches hits """
+    if hitcond not in ('>=', '==', '%'):
+      print "The hit condition is one of >=, == and %."
+      return
+    self.mark('', int(hits), hitcond)
+  def markLog(self, exprs):
+    """ toggle a logpoint logging the expressions separated by ; """
+    self.mark('', 0, '>=', [e.strip() for e in exprs.split(';') if e.strip() != ''])
+  def showLog(self):
+    """ append the lines logged by logpoints since last time to the log window """
+    lines = []
+    while len(self.logLines) > 0:
+      lines.append(self.logLines.popleft())
+    if self.logwin == None:
+      self.logwin = ConsoleWindow('DBGPAVIM_LOG', self.consoleLines)
+    self.logwin.output('\n'.join(lines + ['']) if lines else '')
+    self.logwin.w_command('normal G')
 
   def closeCurrentSession(self):
     ss = self.getCurrentSession()
     if ss:
+      self.lastSession = ss
       del self.debugSessions[ss.address]
       ss.send_command('detach')
       ss.s_close()
@@ -1345,6 +1617,7 @@ class DBGPavim:
 def dbgPavim_init():
   global dbgPavim
   dbgPavim = DBGPavim()
+  dbgpcore.setFrontend(dbgPavim)
 
 error_msg = { \
     # 000 Command parsing errors
@@ -62,6 +62,13 @@
 "
 "                 let g:dbgPavimMaxDepth = 10
 "
+"               g:dbgPavimCacheSize (default 4194304 bytes): The max amount
+"               of variables kept per session to answer repeated property and
+"               context requests until the program moves again.
+"               For example:
+"
+"                 let g:dbgPavimCacheSize = 0
+"
 "               g:dbgPavimBreakAtEntry (default 0): Whether to break at entry,
 "               if set it 0, the debugger engine will break only at
 "               breakpoints.
@@ -69,8 +76,87 @@
 "
 "                 let g:dbgPavimBreakAtEntry = 1
 "
+"               g:dbgPavimPipeline (default 1): Whether to send the commands
+"               issued after each step (stack, context, watches and evals) in
+"               one batch instead of waiting for every reply in turn.
+"               For example:
+"
+"                 let g:dbgPavimPipeline = 0
+"
+"               g:dbgPavimAsync (default 0): Whether to step and run without
+"               blocking VIM, replies are handled by a timer when they arrive
+"               and :Bk breaks a running session. It needs VIM with +timers.
+"               For example:
+"
+"                 let g:dbgPavimAsync = 1
+"
+"               g:dbgPavimPrefetchFrames (default 0): The number of frames,
+"               from the top of the stack, whose variables are fetched in the
+"               background after each stop, so that Up, Dn and <Enter> in the
+"               stack window show them at once. Stepping again discards the
+"               replies still on their way. 0 not to fetch them, nor show
+"               them on Up and Dn.
+"               For example:
+"
+"                 let g:dbgPavimPrefetchFrames = 3
+"
+"               g:dbgPavimWatchDiff (default 1): Whether to update the
+"               context, watches and evals shown after each step in place,
+"               changing and highlighting only the lines that differ, instead
+"               of appending a new dump to the watch window every step.
+"               g:dbgPavimWatchHistory (default 5000): The max number of lines
+"               kept in the watch window, older lines are dropped, 0 for no
+"               limit.
+"               For example:
+"
+"                 let g:dbgPavimWatchDiff = 0
+"
+"               g:dbgPavimFetchSource (default 1): Whether to fetch the files
+"               which do not exist here, as no g:dbgPavimPathMap entry maps
+"               them, from the debugger engine with the DBGp source command.
+"               They are kept in ~/.dbgpavim.sources, by content.
+"               g:dbgPavimSourceTTL (default 3600 seconds): How long a fetched
+"               file is shown again without fetching it again. Each session
+"               fetches a file once before it shows it, in case it changed.
+"
+"               g:dbgPavimConsoleLines (default 10000): The max number of
+"               lines of program output kept in the console window of :Dp,
+"               older lines are dropped, 0 for no limit.
+"
+"               g:dbgPavimProfileInterval (default 10 milliseconds): How long
+"               :DbgProfile lets the program run between two samples of its
+"               stack.
+"
+"               g:dbgPavimMaxQueue (default 0): The max number of connections
+"               waiting to be debugged, further ones are detached to run on
+"               undebugged, 0 for no limit.
+"               g:dbgPavimMaxWait (default 0 seconds): How long a connection
+"               may wait to be debugged before it is detached, 0 for ever.
+"               g:dbgPavimInclude (default {}) and g:dbgPavimExclude (default
+"               {}): Wildcard patterns by fileuri, idekey or address; a
+"               connection is detached right away unless every field of
+"               g:dbgPavimInclude matches one of its patterns, and if any
+"               pattern of g:dbgPavimExclude matches.
+"               For example:
+"
+"                 let g:dbgPavimMaxQueue = 4
+"                 let g:dbgPavimInclude = {'idekey': ['alice']}
+"                 let g:dbgPavimExclude = {'fileuri': ['*/cron/*', '*.js.php']}
+"
+"               g:dbgPavimTraceLevel (default 2): What is written to
+"               ~/.dbgpavim.trace, 0 for nothing, 1 for a summary line per
+"               message, 2 for full messages.
+"               g:dbgPavimTraceSize (default 10485760 bytes): The size at which
+"               the trace file is rotated to ~/.dbgpavim.trace.1, 0 to never
+"               rotate it.
+"               g:dbgPavimTraceTruncate (default 0): The max number of bytes
+"               of each message written at level 2, 0 for no limit.
+"               For example:
+"
+"                 let g:dbgPavimTraceLevel = 1
+"
 "               g:dbgPavimPathMap (default []): Map local path to remote path
-"               on server.
+"               on server, the longest matching prefix wins.
 "               For example:
 "
 "                 let g:dbgPavimPathMap = [['D:/works/php','/var/www'],]
@@ -85,8 +171,10 @@ if !has("python")
     finish
 endif
 
-" Load dbgpavim.py either from the same path where dbgpavim.vim is
-let s:dbgpavim_py = expand("<sfile>:p:h")."/dbgpavim.py"
+" Load dbgpavim.py either from the same path where dbgpavim.vim is,
+" it imports the Vim-free DBGp client core dbgpcore.py next to it
+let s:dbgpavim_dir = expand("<sfile>:p:h")
+let s:dbgpavim_py = s:dbgpavim_dir."/dbgpavim.py"
 
 if !exists('g:dbgPavimPort')
   let g:dbgPavimPort = 9000
@@ -100,12 +188,63 @@ endif
 if !exists('g:dbgPavimMaxDepth')
   let g:dbgPavimMaxDepth = 1
 endif
+if !exists('g:dbgPavimCacheSize')
+  let g:dbgPavimCacheSize = 4194304
+endif
 if !exists('g:dbgPavimBreakAtEntry')
   let g:dbgPavimBreakAtEntry = 0
 endif
 if !exists('g:dbgPavimOnce')
   let g:dbgPavimOnce = 0
 endif
+if !exists('g:dbgPavimPipeline')
+  let g:dbgPavimPipeline = 1
+endif
+if !exists('g:dbgPavimAsync')
+  let g:dbgPavimAsync = 0
+endif
+if !exists('g:dbgPavimPrefetchFrames')
+  let g:dbgPavimPrefetchFrames = 0
+endif
+if !exists('g:dbgPavimWatchDiff')
+  let g:dbgPavimWatchDiff = 1
+endif
+if !exists('g:dbgPavimWatchHistory')
+  let g:dbgPavimWatchHistory = 5000
+endif
+if !exists('g:dbgPavimFetchSource')
+  let g:dbgPavimFetchSource = 1
+endif
+if !exists('g:dbgPavimSourceTTL')
+  let g:dbgPavimSourceTTL = 3600
+endif
+if !exists('g:dbgPavimConsoleLines')
+  let g:dbgPavimConsoleLines = 10000
+endif
+if !exists('g:dbgPavimProfileInterval')
+  let g:dbgPavimProfileInterval = 10
+endif
+if !exists('g:dbgPavimMaxQueue')
+  let g:dbgPavimMaxQueue = 0
+endif
+if !exists('g:dbgPavimMaxWait')
+  let g:dbgPavimMaxWait = 0
+endif
+if !exists('g:dbgPavimInclude')
+  let g:dbgPavimInclude = {}
+endif
+if !exists('g:dbgPavimExclude')
+  let g:dbgPavimExclude = {}
+endif
+if !exists('g:dbgPavimTraceLevel')
+  let g:dbgPavimTraceLevel = 2
+endif
+if !exists('g:dbgPavimTraceSize')
+  let g:dbgPavimTraceSize = 10485760
+endif
+if !exists('g:dbgPavimTraceTruncate')
+  let g:dbgPavimTraceTruncate = 0
+endif
 if !exists('g:dbgPavimPathMap')
   let g:dbgPavimPathMap = []
 endif
@@ -162,6 +301,7 @@ let s:dbgpavim_py_loaded = 0
 function! s:LoadDBGPavim()
   if s:dbgpavim_py_loaded == 0
     if filereadable(s:dbgpavim_py)
+      exec 'python import sys; sys.path.insert(0, "'.escape(s:dbgpavim_dir, '\"').'")'
       exec 'pyfile '.s:dbgpavim_py
       python dbgPavim_init()
       let s:dbgpavim_py_loaded = 1
@@ -177,6 +317,15 @@ function! s:LoadDBGPavim()
       command! -nargs=0 Bl python dbgPavim.list()
       command! -nargs=0 Bc python dbgPavim.clear()
       command! -nargs=0 Bu python dbgPavim.unclear()
+      command! -nargs=0 Bk python dbgPavim.interrupt()
+      command! -nargs=+ Bh python dbgPavim.markHits(<f-args>)
+      command! -nargs=1 Blog python dbgPavim.markLog(<q-args>)
+      command! -nargs=0 DbgLog python dbgPavim.showLog()
+      command! -nargs=? -complete=file DbgStats python dbgPavim.stats(<q-args>)
+      command! -nargs=? -complete=file DbgRecord python dbgPavim.record(<q-args>)
+      command! -nargs=+ -complete=file DbgReplay python dbgPavim.replay(<f-args>)
+      command! -nargs=* -complete=file DbgProfile python dbgPavim.profile(<f-args>)
+      command! -nargs=0 DbgSessions python dbgPavim.sessions()
       command! -nargs=? Wc python dbgPavim.watch("<args>")
       command! -nargs=? We python dbgPavim.eval("<args>")
       command! -nargs=0 Wl python dbgPavim.listWatch()
@@ -237,9 +386,44 @@ function! DbgpavimBindKeys()
   exec 'vnoremap <buffer> '.g:dbgPavimKeyEval.' "vy:python dbgPavim.watch_input("eval", "%v%")<CR>$a<CR>'
 endfunction
 
+" bufnr() takes a pattern, matching in the middle of names too
+function! DbgpavimBufnr(file)
+  return bufnr('^'.escape(a:file, '^$.*?~[]{},\').'$')
+endfunction
+
+function! DbgpavimSrcView(file)
+  let l:nr = DbgpavimBufnr(a:file)
+  if l:nr != bufnr('%')
+    if l:nr > 0 && bufloaded(l:nr)
+      exec 'silent buffer '.l:nr
+    else
+      exec 'silent edit '.fnameescape(a:file)
+      setlocal bufhidden=hide
+    endif
+  endif
+  if !exists('b:dbgpavimKeys')
+    call DbgpavimBindKeys()
+    let b:dbgpavimKeys = 1
+  endif
+endfunction
+
+function! DbgpavimPoll(timer)
+  python dbgPavim.poll()
+endfunction
+
+function! DbgpavimEvents(timer)
+  python dbgPavim.handleEvents()
+endfunction
+
 function! DbgpavimWatchWindowOnEnter()
   let l:line = getline(".")
-  if l:line =~ "^\\s*.* = (.*)+;$"
+  if l:line =~ "^\\s*\\.\\.\\. \\d\\+ more of .* (page \\d\\+)$"
+    let l:var = substitute(l:line,"^\\s*\\.\\.\\. \\d\\+ more of \\(.*\\) (page \\d\\+)$","\\1","")
+    let l:var = substitute(l:var,"'","\\\\'","g")
+    let l:page = substitute(l:line,"^.* (page \\(\\d\\+\\))$","\\1","")
+    execute "python dbgPavim.session_command('expandPage', '".l:var."', ".l:page.")"
+    execute "normal \<c-w>p"
+  elseif l:line =~ "^\\s*.* = (.*)+;$"
     let l:var = substitute(line,"\\s*\\(\\S.*\\S\\)\\s*=.*","\\1","g")
     let l:var = substitute(l:var,"'","\\\\'","g")
     execute "python dbgPavim.session_command('expandVar', '".l:var."')"
@@ -260,6 +444,37 @@ function! DbgpavimStackWindowOnEnter()
   endif
 endfunction
 
+function! DbgpavimSessionsWindowKey(action)
+  let l:address = substitute(getline("."),"^[* ] \\(\\S\\+\\)\\s.*","\\1","")
+  if l:address =~ ":\\d\\+$"
+    execute 'python dbgPavim.sessionAction("'.a:action.'", "'.l:address.'")'
+  endif
+endfunction
+
+function! DbgpavimTabOf(address)
+  for l:tab in range(1, tabpagenr('$'))
+    if gettabvar(l:tab, 'dbgpavimDebugging') == a:address
+      return l:tab
+    endif
+  endfor
+  return 0
+endfunction
+
+function! DbgpavimEnterTab(tab)
+  let t:dbgpavimReturn = 1
+  execute 'noautocmd tabnext '.a:tab
+endfunction
+
+function! DbgpavimLeaveTab()
+  for l:tab in range(1, tabpagenr('$'))
+    if gettabvar(l:tab, 'dbgpavimReturn') == 1
+      execute 'noautocmd tabnext '.l:tab
+      unlet t:dbgpavimReturn
+      return
+    endif
+  endfor
+endfunction
+
 function! DbgpavimCheckPydbgp()
   let l:ret = 0
   let l:pydbgp = executable('pydbgp')
@@ -285,19 +500,27 @@ function! DbgpavimCheckXdebug()
   endif
   return l:ret
 endfunction
-function! DbgpavimSigns()
+function! DbgpavimSigns(...)
+  let l:buf = a:0 > 0 ? a:1 : bufnr('%')
+  let l:file = fnamemodify(bufname(l:buf), ':p')
+  let l:bpts = {}
+  if exists('*sign_getplaced')
+    for l:sign in sign_getplaced(l:buf)[0].signs
+      if l:sign.name == 'breakpt'
+        let l:bpts[l:sign.id] = [l:file, l:sign.lnum]
+      endif
+    endfor
+    return l:bpts
+  endif
   let l:signs = ''
   redir => l:signs
-  silent exec 'sign place buffer='.bufnr('%')
+  silent exec 'sign place buffer='.l:buf
   redir END
-  let l:bpts = {}
   let l:lines = split(l:signs, '\n')
   for l:line in l:lines
-    if l:line =~ "\\S*:$"
-      let l:file = expand("%:p")
-    elseif l:line =~ "^\\s*\\S*=\\d*\\s*\\S*=\\d*\\s*\\S*=breakpt$"
-      let l:lno = substitute(l:line,"^\\s*\\S*=\\(\\d\\+\\)\\s*\\S*=\\d*\\s*\\S*=breakpt$", "\\1", "g")
-      let l:id = substitute(l:line,"^\\s*\\S*=\\d\\+\\s*\\S*=\\(\\d\\+\\)\\s*\\S*=breakpt$", "\\1", "g")
+    if l:line =~ "^\\s*\\S*=\\d*\\s*\\S*=\\d*\\s*\\S*=breakpt"
+      let l:lno = substitute(l:line,"^\\s*\\S*=\\(\\d\\+\\)\\s*\\S*=\\d*\\s*\\S*=breakpt.*$", "\\1", "g")
+      let l:id = substitute(l:line,"^\\s*\\S*=\\d\\+\\s*\\S*=\\(\\d\\+\\)\\s*\\S*=breakpt.*$", "\\1", "g")
       let l:bpts[l:id] = [l:file, l:lno]
     endif
   endfor
@@ -310,5 +533,8 @@ endif
 if !hlexists('DbgBreakPt')
   hi DbgBreakPt term=reverse ctermfg=White ctermbg=Green gui=reverse
 endif
+if !hlexists('DbgChanged')
+  hi link DbgChanged DiffChange
+endif
 sign define current text=->  texthl=DbgCurrent linehl=DbgCurrent
 sign define breakpt text=B>  texthl=DbgBreakPt linehl=DbgBreakPt
@@ -0,0 +1,166 @@
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# A command line DBGp client on top of dbgpcore.py, without Vim.
+#
+# It waits for one debugger engine, sets the breakpoints, runs to the first
+# of them and then reads DBGp commands from a script or stdin, one per line:
+#
+#   python plugin/dbgpcli.py --port 9000 --break /var/www/index.php:12 --script steps.txt
+#
+# where steps.txt holds lines like
+#
+#   stack_get
+#   context_get -d 0
+#   eval count($rows)
+#   step_over
+#   profile 5 index.profile
+#   stats
+#
+# Every reply is printed as text: frames, properties or the status.
+
+import os
+import sys
+import socket
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import dbgpcore
+from dbgpcore import *
+
+class CliSession(DbgSession):
+  """ a session printing every reply it handles """
+  def __init__(self, sock, address):
+    DbgSession.__init__(self, sock, address)
+    self.formatter = PropertyFormatter()
+  def handle_dom(self, resDom):
+    DbgSession.handle_dom(self, resDom)
+    if resDom.tag == "{urn:debugger_protocol_v1}init":
+      self.formatter.language = self.language
+      print "connected to %s, %s" % (self.address, self.fileuri)
+    elif resDom.tag == "{urn:debugger_protocol_v1}response":
+      self.show(resDom)
+    elif resDom.tag == "{urn:debugger_protocol_v1}stream":
+      out = sys.stderr if resDom.get('type') == 'stderr' else sys.stdout
+      out.write(self.formatter.decode_string(resDom.text or '', resDom.get('encoding')))
+  def show(self, res):
+    cmd = res.get('command')
+    error = res.find('{urn:debugger_protocol_v1}error')
+    if error != None:
+      code = error.get('code')
+      message = error.find('{urn:debugger_protocol_v1}message')
+      print "%s: error %s %s" % (cmd, code, message.text if message != None else '')
+    elif cmd == 'stack_get':
+      for s in res.findall('{urn:debugger_protocol_v1}stack'):
+        (fn, win) = dbgpcore.frontend.localFileOf(s.get('filename'))
+        print "%s %s %s:%s" % (s.get('level'), s.get('where'), fn, s.get('lineno'))
+    elif cmd in ('context_get', 'property_get', 'eval'):
+      print self.formatter.parseResponse(res)
+    elif res.get('status') != None:
+      print "%s: %s" % (cmd, res.get('status'))
+    elif cmd not in ('breakpoint_set', 'feature_set', 'stdout', 'stderr'):
+      print "%s: %s" % (cmd, ET.tostring(res))
+
+def parseBreak(spec):
+  """ file, line and condition of a --break file:line[:cond] """
+  parts = spec.split(':')
+  # keep drive letters of Windows paths in the file
+  i = 2 if len(parts) > 2 and len(parts[0]) == 1 else 1
+  return (':'.join(parts[:i]), int(parts[i]), ':'.join(parts[i+1:]))
+
+def execute(ss, line):
+  """ run a command line from the script, return False to quit """
+  line = line.strip()
+  if line == '' or line[0] == '#':
+    return True
+  (cmd, sep, rest) = line.partition(' ')
+  if cmd in ('quit', 'exit'):
+    return False
+  if cmd == 'stats':
+    print '\n'.join(ss.stats.report())
+    return True
+  if cmd == 'profile':
+    profile(ss, *rest.split())
+    return alive(ss)
+  if cmd == 'eval':
+    ss.s_command('eval', '', rest)
+  else:
+    ss.s_command(cmd, rest)
+  return alive(ss)
+
+def profile(ss, seconds = '10', path = 'dbgpavim.profile'):
+  """ sample the stack for seconds, write the samples to path and print the top functions """
+  prof = DbgProfiler(ss.headless())
+  if not prof.supported():
+    print "profile: the debugger engine cannot break a running program"
+  else:
+    status = prof.run(float(seconds))
+    prof.write(path)
+    print '\n'.join(prof.top(20))
+    print "profile: %s, written to %s, %s" % (prof.summary(), path, status)
+  ss.msgid = prof.session.msgid
+  ss.closed = prof.session.closed
+
+class CliFrontend(DbgFrontend):
+  """ the defaults of DbgFrontend, with messages on the terminal """
+  def message(self, text):
+    if text != "":
+      print text
+  def error(self, text):
+    print >>sys.stderr, text
+
+def alive(ss):
+  return ss.sock != None and not ss.closed
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Debug one script through DBGp without Vim.')
+  parser.add_argument('--port', type = int, default = 9000)
+  parser.add_argument('--break', dest = 'breaks', action = 'append', default = [], metavar = 'FILE:LINE[:COND]',
+                      help = 'break point, may be repeated')
+  parser.add_argument('--bae', action = 'store_true', help = 'break at the first line instead of running to a break point')
+  parser.add_argument('--script', help = 'file of commands, stdin without')
+  parser.add_argument('--timeout', type = float, default = 60, help = 'seconds to wait for the engine and each reply')
+  parser.add_argument('--output', action = 'store_true', help = 'print copies of the output of the script')
+  parser.add_argument('--record', metavar = 'FILE', help = 'record the session to FILE, see bench/replay.py')
+  a = parser.parse_args()
+
+  fe = CliFrontend(a.port)
+  setFrontend(fe)
+  for b in a.breaks:
+    fe.breakpt.add(*parseBreak(b))
+  if a.record:
+    recorder.start(a.record)
+
+  serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  serv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  serv.bind(('', a.port))
+  serv.listen(1)
+  serv.settimeout(a.timeout)
+  try:
+    (sock, address) = serv.accept()
+  except socket.timeout:
+    fe.error("no debugger engine connected to port %d in %gs" % (a.port, a.timeout))
+    return 1
+  finally:
+    serv.close()
+  sock.settimeout(a.timeout)
+  ss = CliSession(sock, '%s:%d' % address)
+  if not ss.init():
+    return 1
+  ss.s_commands([('feature_set', '-n max_children -v ' + fe.maxChildren),
+                 ('feature_set', '-n max_data -v ' + fe.maxData),
+                 ('feature_set', '-n max_depth -v ' + fe.maxDepth)])
+  if a.output:
+    ss.s_commands([('stdout', '-c 1', '', '0', True), ('stderr', '-c 1', '', '0', True)])
+  ss.s_command('step_into' if a.bae else 'run')
+
+  script = open(a.script) if a.script else sys.stdin
+  for line in script:
+    if not execute(ss, line):
+      break
+  if alive(ss):
+    ss.s_command('detach')
+  ss.s_close()
+  recorder.stop()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
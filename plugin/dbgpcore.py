@@ -0,0 +1,1725 @@
+# encoding: utf-8
+# vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab
+# -*- c--oding: ko_KR.UTF-8 -*-
+# DBGp client core of DBGPavim: framing, sessions, breakpoints and the
+# background listener, usable without Vim. dbgpavim.py is the Vim front end.
+#
+# Copyright (c) 2012-2013 Brook Hong
+#
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished
+# to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# Authors:
+#    Brook Hong <hzgmaxwell <at> hotmail.com>
+#    The plugin was originally writen by --
+#    Seung Woo Shin <segv <at> sayclub.com>
+#    I rewrote it with a new debugger engine, please diff this file to find code change.
+
+import os
+import sys
+import socket
+import select
+import base64
+import traceback
+import json
+import hashlib
+import fnmatch
+import urllib
+try:
+  import xml.etree.cElementTree as ET
+except ImportError:
+  import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+
+import atexit
+import Queue
+import time
+from threading import Thread,Lock
+
+# time.monotonic() where there is one
+clock = getattr(time, 'monotonic', time.time)
+
+def getFilePath(s):
+  if s[:7] == "file://":
+    fn = s[7:]
+  else:
+    fn = s
+  win = 0
+  if fn[2] == ':':
+    fn = fn[1:]
+    win = 1
+  return [fn, win]
+
+class PathMap(object):
+  """ g:dbgPavimPathMap indexed by prefix, with the paths resolved lately
+
+  The longest local (or remote) prefix that matches wins. Resolved paths,
+  including the file:// URIs normalised by getFilePath(), are cached; when
+  a cache holds cacheSize paths the least recently used quarter is dropped. """
+  cacheSize = 1024
+  def __init__(self, pathMap):
+    self.toRemote = {}
+    self.toLocal  = {}
+    for m in pathMap:
+      if m[0]:
+        self.toRemote.setdefault(m[0], m[1])
+      if m[1]:
+        self.toLocal.setdefault(m[1], m[0])
+    self.remoteLens = sorted(set([len(k) for k in self.toRemote]), reverse=True)
+    self.localLens  = sorted(set([len(k) for k in self.toLocal]), reverse=True)
+    self.remotes = {}
+    self.locals  = {}
+    self.files   = {}
+    self.clock   = 0
+    self.hits    = 0
+    self.misses  = 0
+  def lookup(self, cache, path, resolve):
+    self.clock += 1
+    entry = cache.get(path)
+    if entry != None:
+      self.hits += 1
+      entry[1] = self.clock
+      return entry[0]
+    self.misses += 1
+    if len(cache) >= self.cacheSize:
+      lru = sorted(cache.iteritems(), key=lambda e: e[1][1])
+      for (k, e) in lru[:self.cacheSize/4]:
+        del cache[k]
+    value = resolve(path)
+    cache[path] = [value, self.clock]
+    return value
+  def mapPrefix(self, path, index, lens):
+    for l in lens:
+      target = index.get(path[0:l])
+      if target != None:
+        return target+path[l:]
+    return None
+  def resolveRemote(self, lpath):
+    fn = self.mapPrefix(lpath, self.toRemote, self.remoteLens)
+    if fn != None:
+      return fn
+    fn = lpath
+    if fn[:7] != "file://":
+      fn = fn.replace("\\","/")
+      if fn[1] == ':':
+        fn = "file:///"+fn
+      else:
+        fn = "file://"+fn
+    return fn
+  def resolveLocal(self, rpath):
+    fn = self.mapPrefix(rpath, self.toLocal, self.localLens)
+    if fn != None:
+      return fn
+    return rpath
+  def resolveFile(self, uri):
+    [fn, win] = getFilePath(uri)
+    return (self.resolveLocal(fn), win)
+  def remote(self, lpath):
+    return self.lookup(self.remotes, lpath, self.resolveRemote)
+  def local(self, rpath):
+    return self.lookup(self.locals, rpath, self.resolveLocal)
+  def localFile(self, uri):
+    """ local path of a file:// URI from the debugger engine, and whether the engine runs on Windows """
+    return self.lookup(self.files, uri, self.resolveFile)
+  def stats(self):
+    return "%d paths, %d hits, %d misses" % (len(self.remotes)+len(self.locals)+len(self.files), self.hits, self.misses)
+
+class SourceCache(object):
+  """ remote files fetched with the DBGp source command, stored by content
+
+  A file is written once, to <dir>/<sha1 of its content>/<its name>, so a
+  file fetched again unchanged or shared by several URIs takes no more
+  room. <dir>/index.json maps every URI to its file and the time it was
+  fetched. A session fetches a URI again before it first uses the copy, as
+  the file may have been deployed again since, and then once the copy is
+  older than ttl seconds. """
+  def __init__(self, dir, ttl = 3600):
+    self.dir     = dir
+    self.ttl     = ttl
+    self.index   = None    # loaded on first use
+    self.uris    = {}      # file -> URI it was fetched for
+    self.hits    = 0
+    self.fetches = 0
+  def load(self):
+    if self.index != None:
+      return
+    self.index = {}
+    try:
+      f = open(os.path.join(self.dir, 'index.json'))
+      for (uri, e) in json.load(f).iteritems():
+        self.index[uri.encode('utf-8')] = [e[0].encode('utf-8'), e[1]]
+      f.close()
+    except (IOError, ValueError), e:
+      pass
+    self.uris = dict([(e[0], uri) for (uri, e) in self.index.iteritems()])
+  def save(self):
+    path = os.path.join(self.dir, 'index.json')
+    f = open(path + '.tmp', 'w')
+    json.dump(self.index, f)
+    f.close()
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(path + '.tmp', path)
+  def get(self, uri):
+    """ the local copy of uri if it was fetched within ttl seconds, None otherwise """
+    self.load()
+    entry = self.index.get(uri)
+    if entry != None and time.time() - entry[1] < self.ttl and os.path.exists(entry[0]):
+      self.hits += 1
+      return entry[0]
+    return None
+  def put(self, uri, content):
+    """ store content fetched for uri, return its local copy """
+    self.load()
+    self.fetches += 1
+    folder = os.path.join(self.dir, hashlib.sha1(content).hexdigest())
+    path = os.path.join(folder, urllib.unquote(uri.rstrip('/').split('/')[-1]) or 'source')
+    if not os.path.exists(path):
+      if not os.path.isdir(folder):
+        os.makedirs(folder)
+      f = open(path + '.tmp', 'wb')
+      f.write(content)
+      f.close()
+      os.rename(path + '.tmp', path)
+    self.index[uri] = [path, time.time()]
+    self.uris[path] = uri
+    self.save()
+    return path
+  def uriOf(self, path):
+    """ the URI a local copy was fetched for, None for other files """
+    self.load()
+    return self.uris.get(path)
+  def stats(self):
+    return "%d files, %d hits, %d fetches" % (len(self.index or {}), self.hits, self.fetches)
+
+class DbgTracer(Thread):
+  """ write trace messages from a background thread
+
+  Messages are dropped rather than waited for when the queue is full, the
+  trace file is rotated to <file>.1 when it grows larger than maxSize. """
+  (OFF,SUMMARY,FULL) = (0,1,2)
+  def __init__(self, path):
+    self.path     = path
+    self.level    = self.FULL
+    self.maxSize  = 10*1024*1024
+    self.truncate = 0
+    self.dropped  = 0
+    self.queue    = Queue.Queue(256)
+    Thread.__init__(self)
+    self.daemon   = True
+  def configure(self, level, maxSize, truncate):
+    self.level    = level
+    self.maxSize  = maxSize
+    self.truncate = truncate
+  def trace(self, log, payload = None):
+    if self.level == self.OFF:
+      return
+    if payload != None:
+      if self.level == self.SUMMARY:
+        log = "%s (%d bytes)" % (log, len(payload))
+        payload = None
+      elif self.truncate and len(payload) > self.truncate:
+        payload = "%s... (%d bytes)" % (payload[:self.truncate], len(payload))
+    try:
+      self.queue.put_nowait((log, payload))
+    except Queue.Full:
+      self.dropped += 1
+  def close(self):
+    if self.is_alive():
+      self.queue.put((None, None))
+      self.join(1)
+  def run(self):
+    log = open(self.path, 'w')
+    size = 0
+    while 1:
+      msgs = [self.queue.get()]
+      try:
+        while msgs[-1][0] != None:
+          msgs.append(self.queue.get_nowait())
+      except Queue.Empty:
+        pass
+      for (msg, payload) in msgs:
+        if msg == None:
+          log.close()
+          return
+        log.write("\n"+msg+"\n")
+        size += len(msg) + 2
+        if payload != None:
+          log.write(payload+"\n")
+          size += len(payload) + 1
+      if self.dropped:
+        log.write("\n%d message(s) dropped\n" % self.dropped)
+        self.dropped = 0
+      log.flush()
+      if self.maxSize and size > self.maxSize:
+        log.close()
+        if os.path.exists(self.path+".1"):
+          os.remove(self.path+".1")
+        os.rename(self.path, self.path+".1")
+        log = open(self.path, 'w')
+        size = 0
+
+tracer = DbgTracer(os.path.expanduser("~").replace("\\","/")+"/.dbgpavim.trace")
+tracer.start()
+atexit.register(tracer.close)
+class DbgRecorder(object):
+  """ record every frame sessions send and receive to a JSONL file
+
+  Each line holds the seconds since the recording started, the session
+  address, the direction ('>' sent, '<' received), the frame and, for
+  commands, how the client issued them; frames are stored as latin-1 so
+  any byte survives JSON. Lines are written by a background thread. """
+  def __init__(self):
+    self.active = False
+    self.path   = None
+    self.frames = 0
+  def start(self, path):
+    """ start recording to path, replacing the recording in progress """
+    self.stop()
+    out = open(path, 'w')
+    self.path    = path
+    self.frames  = 0
+    self.started = clock()
+    self.queue   = Queue.Queue()
+    self.writer  = Thread(target = self.run, args = (out, self.queue))
+    self.writer.daemon = True
+    self.writer.start()
+    self.active  = True
+  def stop(self):
+    if self.active:
+      self.active = False
+      self.queue.put(None)
+      self.writer.join()
+  def record(self, address, direction, frame, command = None):
+    if self.active:
+      self.frames += 1
+      self.queue.put((clock() - self.started, address, direction, frame, command))
+  def run(self, out, queue):
+    while 1:
+      item = queue.get()
+      if item == None:
+        break
+      (t, address, direction, frame, command) = item
+      line = OrderedDict([('t', round(t, 6)), ('session', address), ('dir', direction), ('frame', frame.decode('latin-1'))])
+      if command != None:
+        line['command'] = command.decode('latin-1')
+      out.write(json.dumps(line) + "\n")
+    out.close()
+
+recorder = DbgRecorder()
+atexit.register(recorder.stop)
+
+def DBGPavimTrace(log, payload = None):
+  tracer.trace(log, payload)
+
+class DbgpFrameReader(object):
+  """ split length\0xml\0 frames out of a DBGp stream and parse them
+
+  Data is received in large chunks into a reusable buffer. A frame found
+  whole in the buffer, as most replies are, is parsed in one go. The body
+  of a larger one is fed to an incremental XML parser as its bytes arrive,
+  so the raw text of a message is never kept as a whole; bytes beyond the
+  current frame are kept for the next one. """
+  def __init__(self, chunksize = 65536):
+    self.chunk  = bytearray(chunksize)
+    self.view   = memoryview(self.chunk)
+    self.buf    = bytearray()
+    self.pos    = 0
+    self.length = None    # body length of the frame being received
+    self.fed    = 0
+    self.parser = None
+    self.text   = None
+    self.parseTime = 0    # seconds spent parsing the latest frame
+  def pending(self):
+    """ number of bytes received but not consumed yet """
+    return len(self.buf) - self.pos
+  def fill(self, sock):
+    """ receive one chunk from sock, return the number of bytes received """
+    n = sock.recv_into(self.chunk)
+    if n:
+      self.buf += self.view[:n]
+    return n
+  def feed(self, data):
+    self.buf += data
+  def next_msg(self, keepText = False):
+    """ return (resDom, size, text) of the next complete frame, None if more
+    data is needed. text is the raw body if keepText is set, None otherwise. """
+    buf = self.buf
+    if self.length == None:
+      nul = buf.find('\0', self.pos)
+      if nul == -1:
+        return None
+      header = str(buf[self.pos:nul])
+      if not header.isdigit():
+        header = ''.join([c for c in header if c.isdigit()])
+      length = int(header)
+      end = nul + 1 + length
+      if length > 0 and end < len(buf) and buf[end] == 0:
+        # the whole frame is here, as most replies are: parse it at once
+        data = str(buffer(buf, nul + 1, length))
+        self.pos = end + 1
+        self.compact()
+        start = clock()
+        parser = ET.XMLParser(encoding = 'utf-8')
+        parser.feed(data.replace('\n',''))
+        resDom = parser.close()
+        self.parseTime = clock() - start
+        return (resDom, length, data if keepText else None)
+      self.length = length
+      self.pos    = nul + 1
+      self.parseTime = 0
+      self.fed    = 0
+      # Xdebug declares iso-8859-1 but sends utf-8
+      self.parser = ET.XMLParser(encoding = 'utf-8')
+      self.text   = [] if keepText else None
+    n = min(len(buf) - self.pos, self.length - self.fed)
+    if n > 0:
+      data = str(buffer(buf, self.pos, n))
+      if self.text != None:
+        self.text.append(data)
+      start = clock()
+      self.parser.feed(data.replace('\n',''))
+      self.parseTime += clock() - start
+      self.pos += n
+      self.fed += n
+    msg = None
+    if self.fed == self.length:
+      term = buf.find('\0', self.pos)
+      if term != -1:
+        self.pos = term + 1
+        (parser, text, length) = (self.parser, self.text, self.length)
+        (self.parser, self.text, self.length) = (None, None, None)
+        if length == 0:
+          return self.next_msg(keepText)
+        if text != None:
+          text = ''.join(text)
+        start = clock()
+        msg = (parser.close(), length, text)
+        self.parseTime += clock() - start
+    self.compact()
+    return msg
+  def compact(self):
+    """ drop the consumed bytes once the buffer grew beyond a chunk """
+    if self.pos == len(self.buf):
+      del self.buf[:]
+      self.pos = 0
+    elif self.pos > len(self.chunk):
+      del self.buf[:self.pos]
+      self.pos = 0
+
+class PropertyCache(object):
+  """ replies of property_get and context_get at the current stop
+
+  Entries are keyed by the command, its arguments (stack depth, context,
+  fullname, page) and the max_depth/max_children/max_data in effect. The
+  least recently used entries are evicted beyond maxSize bytes of XML. """
+  def __init__(self, maxSize):
+    self.entries = OrderedDict()
+    self.maxSize = maxSize
+    self.size    = 0
+    self.hits    = 0
+    self.misses  = 0
+  def get(self, key):
+    entry = self.entries.pop(key, None)
+    if entry == None:
+      self.misses += 1
+      return None
+    self.entries[key] = entry
+    self.hits += 1
+    return entry[0]
+  def put(self, key, resDom, size):
+    if size > self.maxSize:
+      return
+    if key in self.entries:
+      self.size -= self.entries.pop(key)[1]
+    self.entries[key] = (resDom, size)
+    self.size += size
+    while self.size > self.maxSize:
+      (k, entry) = self.entries.popitem(False)
+      self.size -= entry[1]
+  def clear(self):
+    self.entries.clear()
+    self.size = 0
+  def stats(self):
+    return "%d hits, %d misses, %d entries, %d bytes" % (self.hits, self.misses, len(self.entries), self.size)
+
+class DbgStats(object):
+  """ round trip, parse and handling times of the commands of a session
+
+  The round trip of a command runs from sending it to the last byte of
+  its reply, so it covers the network and the debugger engine. Handling
+  is the dispatch to handle_response_XXX(), rendering included. Percentiles
+  are taken over the latest samples of each command. """
+  samples = 1024
+  def __init__(self):
+    self.commands = OrderedDict()
+    self.inflight = {}
+  def entry(self, name):
+    e = self.commands.get(name)
+    if e == None:
+      e = {'count': 0, 'cached': 0, 'bytesOut': 0, 'bytesIn': 0,
+           'rtt': deque(maxlen=self.samples), 'parse': deque(maxlen=self.samples),
+           'handle': deque(maxlen=self.samples), 'max': {'rtt': 0, 'parse': 0, 'handle': 0}}
+      self.commands[name] = e
+    return e
+  def sample(self, e, kind, value):
+    e[kind].append(value)
+    if value > e['max'][kind]:
+      e['max'][kind] = value
+  def sent(self, tid, name, size):
+    e = self.entry(name)
+    e['count'] += 1
+    e['bytesOut'] += size
+    self.inflight[tid] = (name, clock())
+  def received(self, tid, size, parseTime):
+    if tid == None or int(tid) not in self.inflight:
+      return
+    (name, start) = self.inflight.pop(int(tid))
+    e = self.entry(name)
+    e['bytesIn'] += size
+    self.sample(e, 'rtt', clock() - start)
+    self.sample(e, 'parse', parseTime)
+  def handled(self, name, elapsed):
+    self.sample(self.entry(name), 'handle', elapsed)
+  def cachedReply(self, name):
+    self.entry(name)['cached'] += 1
+  def percentiles(self, e, kind):
+    values = sorted(e[kind])
+    if len(values) == 0:
+      return (0, 0, 0)
+    return (values[len(values)/2], values[int(len(values)*0.95)], e['max'][kind])
+  def summary(self):
+    """ a dict of numbers per command, times in milliseconds """
+    result = OrderedDict()
+    for (name, e) in self.commands.items():
+      d = OrderedDict()
+      for k in ('count', 'cached', 'bytesOut', 'bytesIn'):
+        d[k] = e[k]
+      for kind in ('rtt', 'parse', 'handle'):
+        (p50, p95, pmax) = self.percentiles(e, kind)
+        d[kind] = OrderedDict([('p50', p50*1000), ('p95', p95*1000), ('max', pmax*1000)])
+      result[name] = d
+    return result
+  def report(self):
+    """ the summary as lines of text """
+    lines = ['%-18s %6s %6s %22s %22s %22s %10s %10s' % ('command', 'count', 'cached',
+             'rtt ms p50/p95/max', 'parse ms p50/p95/max', 'handle ms p50/p95/max', 'bytes out', 'bytes in')]
+    for (name, d) in self.summary().items():
+      times = ['%6.1f/%6.1f/%7.1f' % (d[k]['p50'], d[k]['p95'], d[k]['max']) for k in ('rtt', 'parse', 'handle')]
+      lines.append('%-18s %6d %6d %22s %22s %22s %10d %10d' % tuple([name, d['count'], d['cached']] + times + [d['bytesOut'], d['bytesIn']]))
+    return lines
+
+class DbgSession(object):
+  # commands after which the program may have moved or changed its data
+  invalidating_commands = ('step_into', 'step_over', 'step_out', 'run', 'stop', 'detach', 'eval', 'property_set', 'break')
+  cached_commands = ('property_get', 'context_get')
+  def __init__(self, sock, address):
+    self.latestDom = None
+    self.breakDom = None   # reply of the run which broke in the background
+    self.reader = DbgpFrameReader()
+    self.msgid = 0
+    self.sock = sock
+    self.isWinServer = 0
+    self.bptsetlst  = {}
+    self.bptsetids  = {}
+    self.last_command = 'None'
+    self.address = address
+    self.idekey = ''
+    self.retries = 0
+    self.closed = False
+    self.silent_commmands = {}
+    self.sent = {}
+    self.batches = []
+    self.early = {}
+    self.cache = PropertyCache(frontend.cacheSize)
+    self.cachekeys = {}
+    self.prefetching = {}
+    self.sources = {}      # URI -> local copy checked in this session, None if it failed
+    self.created = time.time()
+    self.setupTime = None
+    self.stats = DbgStats()
+  def handle_response_breakpoint_set(self, res):
+    """handle <response command=breakpoint_set> tag
+    <responsponse command="breakpoint_set" id="110180001" transaction_id="1"/>"""
+    tid = res.get('transaction_id')
+    if tid != None:
+      tid = int(tid)
+      bno = self.bptsetlst[tid]
+      del self.bptsetlst[tid]
+      self.bptsetids[bno] = res.get('id')
+  def getbid(self, bno):
+    """ get Debug Server's breakpoint numbered with bno """
+    if bno in self.bptsetids:
+      return self.bptsetids[bno]
+    return None
+  def keepText(self):
+    """ whether the raw text of received messages is needed """
+    return tracer.level == DbgTracer.FULL or recorder.active
+  def recv_msg(self):
+    """ receive the next message, parsed while it arrives """
+    while 1:
+      try:
+        msg = self.reader.next_msg(self.keepText())
+      except ValueError, e:
+        DBGPavimTrace("ValueError %s from %s" % (e, self.address) )
+        self.closed = True
+        return None
+      if msg != None:
+        resDom = self.got_msg(*msg)
+        if not self.prefetched(resDom):
+          return resDom
+        continue
+      if self.reader.fill(self.sock) == 0:
+        self.closed = True
+        return None
+  def poll_msg(self):
+    """ like recv_msg, but return None instead of blocking when no message is complete """
+    while not self.closed:
+      msg = self.reader.next_msg(self.keepText())
+      if msg != None:
+        resDom = self.got_msg(*msg)
+        if not self.prefetched(resDom):
+          return resDom
+        continue
+      (readable, writable, errors) = select.select([self.sock], [], [], 0)
+      if len(readable) == 0:
+        return None
+      if self.reader.fill(self.sock) == 0:
+        self.closed = True
+    return None
+  def send_msg(self, cmd):
+    DBGPavimTrace(str(self.msgid)+">"*16+self.address, cmd)
+    try:
+      self.sock.send(cmd + '\0')
+    except socket.timeout, e:
+      self.retries = self.retries+1
+    except socket.error, e:
+      DBGPavimTrace("Exception when send_msg %d from %s: %s" % (self.msgid, self.address, e[0]) )
+      self.closed = True
+  def handle_dom(self, resDom):
+    if resDom.tag == "{urn:debugger_protocol_v1}response":
+      if resDom.get('command') == "breakpoint_set":
+        self.handle_response_breakpoint_set(resDom)
+      if resDom.get('command') == "stop":
+        self.s_close()
+    elif resDom.tag == "{urn:debugger_protocol_v1}init":
+      self.fileuri = resDom.get('fileuri')
+      self.idekey = resDom.get('idekey') or ''
+      [fn, self.isWinServer] = getFilePath(self.fileuri)
+      self.language = resDom.get('language').lower()
+  def got_msg(self, resDom, size, txt):
+    """ trace a message, remembering it in the cache if it replies a cached command """
+    if txt != None:
+      DBGPavimTrace(str(self.msgid)+"<"*16+self.address, txt)
+      recorder.record(self.address, '<', txt)
+    elif tracer.level != DbgTracer.OFF:
+      DBGPavimTrace(str(self.msgid)+"<"*16+self.address+" (%d bytes)" % size)
+    self.latestDom = resDom
+    tid = resDom.get('transaction_id')
+    self.stats.received(tid, size, self.reader.parseTime)
+    if tid != None and int(tid) in self.cachekeys:
+      key = self.cachekeys.pop(int(tid))
+      if resDom.find('{urn:debugger_protocol_v1}error') == None:
+        self.cache.put(key, resDom, size)
+    return resDom
+  def handle_recvd_msg(self, resDom):
+    try:
+      self.handle_dom(resDom)
+    except:
+      resDom = None
+    return resDom
+  def send_command(self, cmd, arg1 = '', arg2 = '', command = None):
+    self.msgid = self.msgid + 1
+    self.retries = 0
+    line = cmd + ' -i ' + str(self.msgid)
+    if arg1 != '':
+      line = line + ' ' + arg1
+    if arg2 != '':
+      line = line + ' -- ' + base64.encodestring(arg2)[0:-1]
+    self.stats.sent(self.msgid, cmd, len(line)+1)
+    recorder.record(self.address, '>', line, command)
+    self.send_msg(line)
+    return self.msgid
+  def ack_command(self):
+    try:
+      while 1:
+        resDom = self.recv_msg()
+        if resDom == None:
+          return None
+        resDom = self.handle_recvd_msg(resDom)
+        # output of the program arrives in <stream> packets between replies
+        if resDom == None or resDom.tag != "{urn:debugger_protocol_v1}stream":
+          break
+      if resDom != None:
+        tid = resDom.get('transaction_id')
+        if tid != None and int(tid) != int(self.msgid):
+          DBGPavimTrace("Unexpected msg %s when waiting for msg %d from %s" % (tid, self.msgid, self.address) )
+        if self.retries:
+          DBGPavimTrace("Retried %d times for msg %d from %s" % (self.retries, self.msgid, self.address) )
+        self.sent.pop(self.msgid, None)
+      else:
+        DBGPavimTrace("Ignored garbage data from %s" % (self.address) )
+        self.closed = True
+      return resDom
+    except ET.ParseError, e:
+      DBGPavimTrace("Ignored garbage data from %s: %s" % (self.address, e) )
+      self.closed = True
+      return None
+    except socket.timeout, e:
+      self.retries = self.retries+1
+      return None
+    except socket.error, e:
+      DBGPavimTrace("Exception when recv_msg %d from %s: %s" % (self.msgid, self.address, e[0]) )
+      return None
+  def cache_key(self, cmd, arg1, arg2):
+    if cmd in self.cached_commands:
+      return (cmd, arg1, arg2, frontend.maxDepth, frontend.maxChildren, frontend.maxData)
+    return None
+  def queue_command(self, cmd, arg1 = '', arg2 = '', extra = '0', silent = False):
+    """ send a command without waiting for its reply, return its transaction_id """
+    key = self.cache_key(cmd, arg1, arg2)
+    # the evals of the watch list, sent with the context after each stop,
+    # are taken not to change the program, or the context would never stay
+    # cached
+    if cmd in self.invalidating_commands and not (cmd == 'eval' and extra == 'watch'):
+      if len(self.cache.entries) > 0:
+        DBGPavimTrace("Property cache of %s cleared: %s" % (self.address, self.cache.stats()) )
+        self.cache.clear()
+      # replies still on their way describe the old state
+      self.cachekeys.clear()
+      for tid in self.prefetching:
+        self.prefetching[tid] = None
+    if cmd == 'eval':
+      if self.language == 'php':
+        arg2 = '$evalResult=(%s)' %(arg2)
+      else:
+        arg2 = 'evalResult=(%s)' %(arg2)
+    self.last_command = cmd+'('+arg1+','+arg2+','+extra+')'
+    tid = self.send_command(cmd, arg1, arg2, self.last_command)
+    self.sent[tid] = self.last_command
+    if key != None:
+      self.cachekeys[tid] = key
+    if silent:
+      self.silent_commmands[tid] = 1
+    return tid
+  def s_command(self, cmd, arg1 = '', arg2 = '', extra = '0', silent = False):
+    key = self.cache_key(cmd, arg1, arg2)
+    resDom = None
+    if key != None:
+      for (tid, k) in self.prefetching.items():
+        if k == key:
+          self.await_prefetch(tid)
+      resDom = self.cache.get(key)
+    if resDom != None:
+      # answer from the cache, as if the command was sent again
+      self.stats.cachedReply(cmd)
+      tid = int(resDom.get('transaction_id'))
+      self.last_command = cmd+'('+arg1+','+arg2+','+extra+')'
+      self.sent[tid] = self.last_command
+      self.handle_dom(resDom)
+      self.sent.pop(tid, None)
+      return resDom
+    self.queue_command(cmd, arg1, arg2, extra, silent)
+    return self.ack_command()
+  def prefetch(self, levels):
+    """ send context_get for the stack levels without waiting, their replies
+    are only kept in the cache, to be shown at once when asked for """
+    last = self.last_command
+    for level in levels:
+      key = self.cache_key('context_get', '-d %d' % level, '')
+      if key in self.cache.entries or key in self.prefetching.values():
+        continue
+      tid = self.queue_command('context_get', '-d %d' % level, '', 'prefetch')
+      self.prefetching[tid] = key
+    self.last_command = last
+  def prefetched(self, resDom):
+    """ whether resDom replies a prefetch, which needs no other handling """
+    if len(self.prefetching) == 0:
+      return False
+    tid = resDom.get('transaction_id')
+    if tid == None or int(tid) not in self.prefetching:
+      return False
+    del self.prefetching[int(tid)]
+    self.sent.pop(int(tid), None)
+    return True
+  def await_prefetch(self, tid):
+    """ wait for the reply of the prefetch tid, handling the messages received meanwhile """
+    try:
+      while tid in self.prefetching and not self.closed:
+        msg = self.reader.next_msg(self.keepText())
+        if msg == None:
+          if self.reader.fill(self.sock) == 0:
+            self.closed = True
+          continue
+        resDom = self.got_msg(*msg)
+        if not self.prefetched(resDom):
+          self.handle_dom(resDom)
+    except (socket.error, ValueError, ET.ParseError), e:
+      DBGPavimTrace("Exception when waiting for prefetch %d from %s: %s" % (tid, self.address, e) )
+  def s_pipeline(self, commands):
+    """ send all commands at once, then collect their replies by transaction_id,
+    replies are handled in the order of commands after all of them arrived """
+    tids = []
+    for c in commands:
+      tids.append(self.queue_command(*c))
+    return self.collect_replies(tids)
+  def collect_replies(self, tids):
+    """ wait for replies of the commands numbered tids and handle them in order """
+    replies = {}
+    while len(replies) < len(tids) and not self.closed:
+      try:
+        resDom = self.recv_msg()
+      except ET.ParseError, e:
+        DBGPavimTrace("Ignored garbage data from %s: %s" % (self.address, e) )
+        self.closed = True
+        break
+      except socket.timeout, e:
+        self.retries = self.retries+1
+        DBGPavimTrace("Timeout with %d of %d replies from %s" % (len(replies), len(tids), self.address) )
+        break
+      except socket.error, e:
+        DBGPavimTrace("Exception when recv_msg %d from %s: %s" % (self.msgid, self.address, e[0]) )
+        break
+      if resDom == None:
+        break
+      tid = resDom.get('transaction_id')
+      if tid != None and int(tid) in self.sent and int(tid) in tids:
+        replies[int(tid)] = resDom
+      elif resDom.tag == "{urn:debugger_protocol_v1}stream":
+        self.handle_dom(resDom)
+      else:
+        DBGPavimTrace("Unexpected msg %s when waiting for msg %d-%d from %s" % (tid, tids[0], tids[-1], self.address) )
+        self.handle_dom(resDom)
+    result = []
+    for tid in tids:
+      resDom = replies.get(tid)
+      if resDom != None:
+        self.handle_dom(resDom)
+      self.sent.pop(tid, None)
+      result.append(resDom)
+    return result
+  def async_commands(self, commands, callback = None):
+    """ send commands without waiting, their replies are handled by poll() """
+    tids = []
+    for c in commands:
+      tids.append(self.queue_command(*c))
+    self.batches.append((tids, callback))
+  def expecting(self, tid):
+    for (tids, callback) in self.batches:
+      if tid in tids:
+        return True
+    return False
+  def readable(self):
+    """ whether poll() has anything to handle, checked without blocking """
+    if self.closed or self.sock == None or self.reader.pending() > 0:
+      return True
+    (readable, writable, errors) = select.select([self.sock], [], [], 0)
+    return len(readable) > 0
+  def poll(self):
+    """ handle the replies which already arrived without blocking,
+    return the number of messages received """
+    received = 0
+    while len(self.batches) > 0 and not self.closed:
+      resDom = self.poll_msg()
+      if resDom == None:
+        break
+      received += 1
+      tid = resDom.get('transaction_id')
+      if tid != None and self.expecting(int(tid)):
+        self.early[int(tid)] = resDom
+      elif resDom.tag == "{urn:debugger_protocol_v1}stream":
+        self.handle_dom(resDom)
+      else:
+        DBGPavimTrace("Unexpected msg %s when polling from %s" % (tid, self.address) )
+        self.handle_dom(resDom)
+      while len(self.batches) > 0 and len([t for t in self.batches[0][0] if t not in self.early]) == 0:
+        (tids, callback) = self.batches.pop(0)
+        for t in tids:
+          self.handle_dom(self.early.pop(t))
+          self.sent.pop(t, None)
+        if callback != None:
+          callback()
+    return received
+  def s_commands(self, commands):
+    """ run a batch of commands, pipelined if g:dbgPavimPipeline is set """
+    if frontend.pipeline:
+      return self.s_pipeline(commands)
+    result = []
+    for c in commands:
+      result.append(self.s_command(*c))
+    return result
+  def getExtra(self, res = None):
+    extra = ""
+    cmd = self.last_command
+    if res != None and res.get('transaction_id') != None:
+      cmd = self.sent.get(int(res.get('transaction_id')), cmd)
+    if cmd != None:
+      t = cmd.split(',')
+      extra = t[-1][:-1]
+    return extra
+  def s_close(self):
+    if self.sock:
+      self.sock.close()
+      self.sock = None
+  def source(self, uri):
+    """ local copy of the remote file uri, fetched with the source command
+    once in the session and when the copy in the source cache is older than
+    its ttl, None if it is not available """
+    if not frontend.fetchSource or self.sock == None:
+      return frontend.sources.get(uri)
+    if uri in self.sources:
+      path = self.sources[uri]
+      if path == None or frontend.sources.get(uri) != None:
+        return path
+    res = self.s_command('source', '-f ' + uri, '', '0', True)
+    if res == None or res.get('command') != 'source' or res.find('{urn:debugger_protocol_v1}error') != None:
+      # not asked again in this session
+      self.sources[uri] = None
+      return None
+    content = res.text or ''
+    if isinstance(content, unicode):
+      content = content.encode('utf-8')
+    if res.get('encoding') == 'base64':
+      content = base64.decodestring(content)
+    self.sources[uri] = frontend.sources.put(uri, content)
+    return self.sources[uri]
+  def send_breakpoint(self, bno):
+    """ send breakpoint bno, return its transaction_id """
+    fn = frontend.remotePathOf(frontend.breakpt.getfile(bno))
+    msgid = self.queue_command('breakpoint_set', frontend.breakpt.args(bno, fn), frontend.breakpt.getexp(bno))
+    self.bptsetlst[msgid] = bno
+    return msgid
+  def send_breakpoints(self):
+    """ send all breakpoints in one burst, return their transaction_ids """
+    return [self.send_breakpoint(bno) for bno in frontend.breakpt.list()]
+  def setup_done(self):
+    self.setupTime = time.time() - self.created
+    DBGPavimTrace("Session %s set up with %d breakpoint(s) in %.3fs" % (self.address, len(self.bptsetids), self.setupTime) )
+  def init(self):
+    self.ack_command()
+    if self.closed:
+      pass
+    elif frontend.pipeline:
+      self.collect_replies(self.send_breakpoints())
+    else:
+      # for engines which cannot take commands sent ahead, one at a time
+      for bno in frontend.breakpt.list():
+        if self.closed:
+          break
+        self.collect_replies([self.send_breakpoint(bno)])
+    self.setup_done()
+    return not self.closed
+  def logpointAt(self, stack):
+    """ the logpoint the frame stack of a stack_get reply is at and file:line
+    of the frame, (None, None) if it is not at one """
+    if stack == None:
+      return (None, None)
+    (fn, win) = frontend.localFileOf(stack.get('filename'))
+    return (frontend.breakpt.logpointAt(fn, stack.get('lineno')), "%s:%s" % (fn, stack.get('lineno')))
+  def log(self, bno, where, replies):
+    """ log the values of the expressions of logpoint bno, replies holds their evals """
+    now = time.time()
+    stamp = time.strftime('%H:%M:%S', time.localtime(now)) + '.%03d' % int(now % 1 * 1000)
+    formatter = PropertyFormatter()
+    formatter.language = self.language
+    for (e, res) in zip(frontend.breakpt.getlog(bno), replies):
+      frontend.logged('%s %s %s %s = %s' % (stamp, self.address, where, e, formatter.parseValue(res)))
+  def logAtBreak(self):
+    """ whether the session broke at a logpoint, which is logged for the
+    session to run on, without the replies reaching the front end """
+    if len(frontend.breakpt.logpoints) == 0:
+      return False
+    ss = self.headless()
+    res = ss.s_command('stack_get', '-d 0')
+    (bno, where) = (None, None)
+    if res != None:
+      (bno, where) = ss.logpointAt(res.find('{urn:debugger_protocol_v1}stack'))
+    if bno != None:
+      ss.log(bno, where, ss.s_pipeline([('eval', '', e) for e in frontend.breakpt.getlog(bno)]))
+    self.msgid = ss.msgid
+    self.closed = ss.closed
+    return bno != None
+  def headless(self):
+    """ a DbgSession on the same connection, sharing the statistics of this
+    one, whose replies are not handled by any front end """
+    ss = DbgSession(self.sock, self.address)
+    (ss.reader, ss.msgid, ss.stats, ss.prefetching) = (self.reader, self.msgid, self.stats, self.prefetching)
+    (ss.language, ss.fileuri, ss.isWinServer) = (self.language, self.fileuri, self.isWinServer)
+    return ss
+
+class DbgProfiler(object):
+  """ sample where a running program spends its time
+
+  The session runs, every interval seconds it is interrupted with break,
+  its stack is sampled with stack_get and it runs on. Samples are counted
+  by stack, outermost frame first. The time the program spends paused for
+  sampling is measured, to tell how much the profile is distorted. """
+  def __init__(self, ss, interval = 0.01):
+    self.session  = ss
+    self.interval = interval
+    self.stacks   = {}
+    self.files    = {}
+    self.samples  = 0
+    self.elapsed  = 0
+    self.paused   = 0
+    self.pausedAt = None
+    self.tid      = None
+    # the engine does not acknowledge run before it breaks, break must not
+    # wait for that behind Nagle's algorithm
+    ss.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  def supported(self):
+    """ whether the engine can break a running program """
+    res = self.session.s_command('feature_get', '-n supports_async')
+    return res != None and res.get('supported') != '0' and (res.text or '').strip() == '1'
+  def run(self, duration):
+    """ sample until duration seconds passed, the program stopped or Ctrl-C
+    was pressed, return the status of the session """
+    start = clock()
+    status = 'break'
+    try:
+      while status == 'break' and clock() - start < duration:
+        status = self.cycle()
+    except KeyboardInterrupt:
+      if self.tid != None:
+        status = self.pause()
+    self.elapsed += clock() - start
+    self.pausedAt = None
+    return status
+  def cycle(self):
+    ss = self.session
+    self.tid = ss.queue_command('run')
+    if self.pausedAt != None:
+      self.paused += clock() - self.pausedAt
+    res = self.wait(clock() + self.interval)
+    if res != None:
+      # the program ended or hit a break point before the interval passed
+      self.tid = None
+      self.pausedAt = None
+      return res.get('status')
+    status = self.pause()
+    if status == 'break':
+      self.record(ss.s_command('stack_get'))
+    return status
+  def wait(self, deadline):
+    """ the reply to run if it arrives before deadline, None if it does not """
+    ss = self.session
+    while not ss.closed:
+      resDom = ss.poll_msg()
+      if resDom == None:
+        timeout = deadline - clock()
+        if timeout <= 0:
+          break
+        select.select([ss.sock], [], [], timeout)
+        continue
+      tid = resDom.get('transaction_id')
+      ss.handle_dom(resDom)
+      if tid != None and int(tid) == self.tid:
+        ss.sent.pop(self.tid, None)
+        return resDom
+    return None
+  def pause(self):
+    """ break the running program, return the status it ran to """
+    ss = self.session
+    self.pausedAt = clock()
+    replies = ss.collect_replies([self.tid, ss.queue_command('break')])
+    self.tid = None
+    if replies[0] == None:
+      return None
+    return replies[0].get('status')
+  def record(self, res):
+    if res == None:
+      return
+    names = []
+    for s in res.findall('{urn:debugger_protocol_v1}stack'):
+      name = (s.get('where') or '{main}').replace(';', ':')
+      self.files.setdefault(name, '%s:%s' % (getFilePath(s.get('filename'))[0], s.get('lineno')))
+      names.append(name)
+    if len(names) > 0:
+      names.reverse()
+      key = tuple(names)
+      self.stacks[key] = self.stacks.get(key, 0) + 1
+      self.samples += 1
+  def collapsed(self):
+    """ the samples in the collapsed stack format of flamegraph.pl """
+    return ['%s %d' % (';'.join(k), n) for (k, n) in sorted(self.stacks.iteritems())]
+  def top(self, count = 50):
+    """ lines of the functions found in most samples, at the top of the stack or anywhere """
+    own = {}
+    total = {}
+    for (k, n) in self.stacks.iteritems():
+      own[k[-1]] = own.get(k[-1], 0) + n
+      for name in set(k):
+        total[name] = total.get(name, 0) + n
+    lines = ['%7s %7s %8s  %s' % ('self%', 'total%', 'samples', 'function')]
+    for name in sorted(total.keys(), key=lambda f: (-own.get(f, 0), -total[f]))[:count]:
+      lines.append('%6.1f%% %6.1f%% %8d  %s %s' % (100.0*own.get(name, 0)/self.samples, 100.0*total[name]/self.samples,
+                                                  own.get(name, 0), name, self.files[name]))
+    return lines
+  def summary(self):
+    if self.samples == 0:
+      return 'No samples taken in %.1fs' % self.elapsed
+    return '%d samples in %.1fs, the program was paused %.3fs (%.1f%%, %.2fms per sample)' % \
+        (self.samples, self.elapsed, self.paused, 100*self.paused/(self.elapsed or 1), 1000*self.paused/self.samples)
+  def write(self, path):
+    f = open(path, 'w')
+    f.write('\n'.join(self.collapsed()) + '\n')
+    f.close()
+
+class DbgReplay(object):
+  """ a recording of DbgRecorder, fed back through sessions """
+  def __init__(self, path):
+    self.records = [json.loads(line) for line in open(path) if line.strip() != '']
+  def addresses(self):
+    """ addresses of the recorded sessions, in the order they started """
+    result = []
+    for r in self.records:
+      if r['session'] not in result:
+        result.append(r['session'])
+    return result
+  def init(self, address):
+    """ the <init> message of session address """
+    for r in self.records:
+      if r['session'] == address and r['dir'] == '<':
+        return ET.fromstring(r['frame'].encode('latin-1').replace('\n', ''))
+    return None
+  def replay(self, ss, address, speed = 0):
+    """ feed the frames of session address to ss as if it had sent the same
+    commands and received the same replies. speed 1 takes as long as the
+    recorded session, 2 half of it, 0 does not wait at all. Return the
+    number of frames and the seconds taken. """
+    (frames, first, start) = (0, None, clock())
+    prefetches = set()
+    for r in self.records:
+      if r['session'] != address:
+        continue
+      if first == None:
+        first = r['t']
+      elif speed:
+        delay = (r['t'] - first)/speed - (clock() - start)
+        if delay > 0:
+          time.sleep(delay)
+      frame = r['frame'].encode('latin-1')
+      if r['dir'] == '>':
+        args = frame.split(' ')
+        tid = int(args[args.index('-i')+1])
+        ss.msgid = tid
+        ss.last_command = r.get('command', args[0]+'(,,0)').encode('latin-1')
+        ss.sent[tid] = ss.last_command
+        ss.stats.sent(tid, args[0], len(frame)+1)
+        if ss.last_command.endswith(',prefetch)'):
+          prefetches.add(tid)
+      else:
+        ss.reader.feed(str(len(frame)) + '\0' + frame + '\0')
+        resDom = ss.recv_msg()
+        if resDom != None:
+          tid = resDom.get('transaction_id')
+          # prefetched replies were only cached
+          if tid == None or int(tid) not in prefetches:
+            ss.handle_recvd_msg(resDom)
+          if tid != None:
+            ss.sent.pop(int(tid), None)
+      frames += 1
+    return (frames, clock() - start)
+
+class DbgSilentClient(object):
+  """ drive a session in the background until it breaks
+
+  DbgListener calls on_readable() whenever the socket of the session has
+  data, so that any number of sessions are served by one thread. When it
+  breaks at a logpoint, the expressions of the logpoint are evaluated and
+  logged, then the session runs on without ever reaching the front end. """
+  (INIT,BREAKPOINT,RUN,STOP,DONE,LOG) = (0,1,2,3,4,5)
+  timeout = 600
+  def __init__(self, ss, bae = False):
+    self.session  = ss
+    self.bae      = bae
+    self.state    = self.INIT
+    self.tids     = []
+    self.deadline = time.time() + self.timeout
+    self.logpoint = None
+    self.values   = {}
+    self.unsent   = []
+  def resume(self):
+    """ let a session which was being debugged run to its next break """
+    self.session.queue_command('run')
+    self.state = self.RUN
+  def close(self):
+    self.session.s_close()
+    self.state = self.DONE
+  def on_readable(self):
+    ss = self.session
+    try:
+      if ss.reader.fill(ss.sock) == 0:
+        ss.closed = True
+      while self.state != self.DONE and not ss.closed:
+        msg = ss.reader.next_msg(ss.keepText())
+        if msg == None:
+          break
+        resDom = ss.got_msg(*msg)
+        if not ss.prefetched(resDom):
+          self.on_msg(resDom)
+    except (socket.error, ValueError, ET.ParseError), e:
+      DBGPavimTrace("Exception from %s: %s" % (ss.address, e) )
+      ss.closed = True
+    if ss.closed and self.state != self.DONE:
+      self.close()
+  def on_msg(self, resDom):
+    ss = self.session
+    resDom = ss.handle_recvd_msg(resDom)
+    if resDom == None:
+      DBGPavimTrace("Ignored garbage data from %s" % (ss.address) )
+      ss.closed = True
+      return
+    if resDom.tag == "{urn:debugger_protocol_v1}stream":
+      return
+    tid = resDom.get('transaction_id')
+    if tid != None:
+      ss.sent.pop(int(tid), None)
+    if self.state == self.INIT:
+      if not frontend.debugListener.admit(ss):
+        self.state = self.DONE
+        return
+      if frontend.pipeline:
+        self.tids = ss.send_breakpoints()
+      else:
+        # without g:dbgPavimPipeline, each breakpoint waits for the reply of the previous one
+        self.unsent = frontend.breakpt.list()
+        self.tids = []
+      self.state = self.BREAKPOINT
+    elif self.state == self.BREAKPOINT:
+      if tid != None and int(tid) in self.tids:
+        self.tids.remove(int(tid))
+    if self.state == self.BREAKPOINT and len(self.tids) == 0 and len(self.unsent) > 0:
+      self.tids = [ss.send_breakpoint(self.unsent.pop(0))]
+      return
+    elif self.state == self.RUN:
+      status = resDom.get('status')
+      if status == "stopping":
+        ss.queue_command('stop')
+        self.state = self.STOP
+      elif status == "break":
+        # replayed when the session is debugged, stack_get comes after it
+        ss.breakDom = resDom
+        if len(frontend.breakpt.logpoints) > 0:
+          # find out whether it is a logpoint
+          self.logpoint = None
+          self.tids = [ss.queue_command('stack_get', '-d 0')]
+          self.state = self.LOG
+        else:
+          self.state = self.DONE
+          frontend.debugListener.newSession(ss, True)
+      return
+    elif self.state == self.LOG:
+      self.on_log(resDom)
+      return
+    elif self.state == self.STOP:
+      self.close()
+      return
+    if self.state == self.BREAKPOINT and len(self.tids) == 0:
+      ss.setup_done()
+      if self.bae:
+        self.state = self.DONE
+        frontend.debugListener.newSession(ss, False)
+      else:
+        self.resume()
+
+  def on_log(self, resDom):
+    ss = self.session
+    tid = resDom.get('transaction_id')
+    if tid == None or int(tid) not in self.tids:
+      return
+    if self.logpoint == None:
+      (self.logpoint, self.where) = ss.logpointAt(resDom.find('{urn:debugger_protocol_v1}stack'))
+      if self.logpoint == None:
+        self.state = self.DONE
+        frontend.debugListener.newSession(ss, True)
+        return
+      self.values = {}
+      self.tids = [ss.queue_command('eval', '', e) for e in frontend.breakpt.getlog(self.logpoint)]
+    else:
+      self.values[int(tid)] = resDom
+    if len(self.values) < len(self.tids):
+      return
+    ss.log(self.logpoint, self.where, [self.values[tid] for tid in self.tids])
+    self.deadline = time.time() + self.timeout
+    self.resume()
+
+class DbgAdmission(object):
+  """ which connections DbgListener lets queue for debugging
+
+  Every queued connection holds a worker of the server blocked, so the
+  others are detached, to run on undebugged: those beyond maxQueue waiting
+  sessions, those left waiting longer than maxWait seconds, and those whose
+  fileuri, idekey or address matches none of the include patterns or one of
+  the exclude patterns. Patterns are shell wildcards, by field:
+
+    {'fileuri': ['*/admin/*'], 'idekey': ['alice', 'bob'], 'address': ['10.0.*']} """
+  fields = ('fileuri', 'idekey', 'address')
+  def __init__(self, maxQueue = 0, maxWait = 0, include = {}, exclude = {}):
+    self.configure(maxQueue, maxWait, include, exclude)
+    self.accepted = 0
+    self.rejected = 0
+    self.reasons  = OrderedDict()
+  def configure(self, maxQueue, maxWait, include, exclude):
+    self.maxQueue = maxQueue
+    self.maxWait  = maxWait
+    self.include  = self.patterns(include)
+    self.exclude  = self.patterns(exclude)
+  def patterns(self, rules):
+    result = {}
+    for (field, patterns) in (rules or {}).iteritems():
+      if field not in self.fields:
+        raise ValueError("No field %s to filter connections on, only %s" % (field, ', '.join(self.fields)))
+      result[field] = [patterns] if isinstance(patterns, basestring) else list(patterns)
+    return result
+  def matches(self, ss, field, patterns):
+    value = getattr(ss, field, None) or ''
+    for p in patterns:
+      if fnmatch.fnmatchcase(value, p):
+        return True
+    return False
+  def check(self, ss, queued):
+    """ why the connection of ss is rejected with queued sessions waiting, None to accept it """
+    for (field, patterns) in self.include.iteritems():
+      if not self.matches(ss, field, patterns):
+        return 'not included by ' + field
+    for (field, patterns) in self.exclude.iteritems():
+      if self.matches(ss, field, patterns):
+        return 'excluded by ' + field
+    if self.maxQueue and queued >= self.maxQueue:
+      return 'queue full'
+    return None
+  def expired(self, ss, now):
+    return self.maxWait and now - ss.queuedAt > self.maxWait
+  def accept(self):
+    self.accepted += 1
+  def reject(self, ss, reason):
+    """ detach the session, it runs on without debugging """
+    DBGPavimTrace("Detached %s (%s, %s): %s" % (ss.address, ss.fileuri, ss.idekey, reason) )
+    self.rejected += 1
+    self.reasons[reason] = self.reasons.get(reason, 0) + 1
+    if ss.sock != None:
+      ss.send_command('detach')
+      # not the s_close() of a front end, no window was opened for it
+      DbgSession.s_close(ss)
+  def stats(self):
+    reasons = ''.join([', %d %s' % (n, r) for (r, n) in self.reasons.iteritems()])
+    return '%d accepted, %d rejected%s' % (self.accepted, self.rejected, reasons)
+
+class DbgListener(Thread):
+  (LISTEN,CLOSED) = (0,1)
+  """ DBGp Procotol class """
+  def __init__(self, port):
+    self.port     = port
+    self.session_queue = []
+    self.resumed  = []
+    self.closeClients = False
+    self._status  = self.CLOSED
+    self.lock = Lock()
+    Thread.__init__(self)
+  def l_start(self):
+    Thread.start(self)
+    time.sleep(0.1)
+    frontend.updateStatusLine()
+  def pendingCount(self):
+    self.lock.acquire()
+    c = len(self.session_queue)
+    self.lock.release()
+    return c
+  def admit(self, ss):
+    """ whether the new connection ss may go on to be set up and queued,
+    it is detached if not """
+    reason = frontend.admission.check(ss, self.pendingCount())
+    if reason == None:
+      return True
+    frontend.admission.reject(ss, reason)
+    frontend.updateStatusLine()
+    return False
+  def newSession(self, ss, bap):
+    self.lock.acquire()
+    c = len(self.session_queue)
+    self.lock.release()
+    # the queue may have filled while the session was set up
+    reason = frontend.admission.check(ss, c)
+    if reason != None:
+      frontend.admission.reject(ss, reason)
+      frontend.updateStatusLine()
+      return
+    ss = frontend.adopt(ss)
+    ss.bap = bap
+    ss.queuedAt = time.time()
+    self.lock.acquire()
+    self.session_queue.append(ss)
+    c = len(self.session_queue)
+    frontend.admission.accept()
+    self.lock.release()
+    frontend.updateStatusLine()
+    if frontend.dbgPavimOnce:
+      self.stop(False)
+    frontend.sessionQueued(ss, c)
+  def queued(self):
+    """ the sessions waiting to be debugged, oldest first """
+    self.lock.acquire()
+    sessions = list(self.session_queue)
+    self.lock.release()
+    return sessions
+  def take(self, address):
+    """ remove the session of address from the queue, None if it is not queued """
+    session = None
+    self.lock.acquire()
+    for ss in self.session_queue:
+      if ss.address == address:
+        session = ss
+        self.session_queue.remove(ss)
+        break
+    self.lock.release()
+    return session
+  def expire(self):
+    """ detach the queued sessions which waited longer than allowed """
+    now = time.time()
+    self.lock.acquire()
+    expired = [ss for ss in self.session_queue if frontend.admission.expired(ss, now)]
+    for ss in expired:
+      self.session_queue.remove(ss)
+    self.lock.release()
+    for ss in expired:
+      frontend.admission.reject(ss, 'waited too long')
+    if len(expired) > 0:
+      frontend.updateStatusLine()
+  def resume(self, ss):
+    """ hand a session back to the background loop, to run until its next break """
+    self.lock.acquire()
+    self.resumed.append(ss)
+    self.lock.release()
+  def nextSession(self):
+    session = None
+    self.lock.acquire()
+    if len(self.session_queue) > 0:
+      session = self.session_queue.pop(0)
+    self.lock.release()
+    frontend.message("")
+    return session
+  def stop(self, closeConnection = True):
+    self.lock.acquire()
+    try:
+      if self._status == self.LISTEN:
+        client = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
+        client.connect ( ( '127.0.0.1', self.port ) )
+        client.close()
+    finally:
+      self.closeClients = closeConnection
+      if closeConnection:
+        for s in self.session_queue:
+          s.send_command('detach')
+          s.sock.close()
+        del self.session_queue[:]
+    self._status = self.CLOSED
+    self.lock.release()
+    frontend.updateStatusLine()
+  def status(self):
+    self.lock.acquire()
+    s = self._status
+    self.lock.release()
+    return s
+  def run(self):
+    self.lock.acquire()
+    serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    serv.settimeout(None)
+    try:
+      serv.bind(('', self.port))
+    except socket.error, e:
+      frontend.error("Can not bind to port "+str(self.port)+', Socket Error '+str(e[0]))
+      self.lock.release()
+      return
+    frontend.message("")
+    serv.listen(socket.SOMAXCONN)
+    self._status = self.LISTEN
+    self.lock.release()
+    DBGPavimTrace("DbgListener started at %d!" % (self.port))
+    clients = {}
+    while 1:
+      if serv != None and self.status() != self.LISTEN:
+        serv.close()
+        serv = None
+      if serv == None and (self.closeClients or len(clients) == 0):
+        break
+      self.lock.acquire()
+      for ss in self.resumed:
+        client = DbgSilentClient(ss)
+        client.resume()
+        clients[ss.sock] = client
+      del self.resumed[:]
+      self.lock.release()
+      socks = clients.keys()
+      if serv != None:
+        socks.append(serv)
+      (readable, writable, errors) = select.select(socks, [], [], 1)
+      for sock in readable:
+        if sock == serv:
+          (sock, address) = serv.accept()
+          adr = '%s:%d' % (address[0], address[1])
+          DBGPavimTrace('# Connection from %s\n' % adr)
+          clients[sock] = DbgSilentClient(DbgSession(sock, adr), frontend.breakAtEntry)
+        else:
+          clients[sock].on_readable()
+      self.expire()
+      now = time.time()
+      for sock in clients.keys():
+        client = clients[sock]
+        if client.state != DbgSilentClient.DONE and now > client.deadline:
+          DBGPavimTrace("Gave up waiting for %s!" % (client.session.address))
+          client.close()
+        if client.state == DbgSilentClient.DONE:
+          del clients[sock]
+    for client in clients.values():
+      client.close()
+    DBGPavimTrace("DbgListener stopped at %d!" % (self.port))
+
+class BreakPoint:
+  """ Breakpoint class """
+  def __init__(self):
+    """ initalize """
+    self.dictionaries  = {}
+    self.index    = {}
+    self.ticks    = {}
+    self.logpoints = set()
+    self.startbno = 10000
+    self.maxbno   = self.startbno
+  def clear(self):
+    """ clear of breakpoint number """
+    self.dictionaries.clear()
+    self.index.clear()
+    self.ticks.clear()
+    self.logpoints.clear()
+    self.maxbno = self.startbno
+  def add(self, file, line, exp = '', hits = 0, hitcond = '>=', log = None):
+    """ add break point at file:line. With hits, it breaks only when its hit
+    count compared with hitcond (>=, == or %) matches hits. With a list of
+    expressions in log, it is a logpoint: the expressions are logged and
+    the program runs on. """
+    self.maxbno = self.maxbno + 1
+    self.dictionaries[self.maxbno] = { 'file':file, 'line':int(line), 'exp':exp,
+                                       'hits':int(hits), 'hitcond':hitcond, 'log':log or [] }
+    self.index[(file, int(line))] = self.maxbno
+    if log:
+      self.logpoints.add(self.maxbno)
+    return self.maxbno
+  def remove(self, bno):
+    """ remove break point numbered with bno """
+    self.logpoints.discard(bno)
+    bp = self.dictionaries.pop(bno)
+    if self.index.get((bp['file'], bp['line'])) == bno:
+      del self.index[(bp['file'], bp['line'])]
+  def sync(self, file):
+    """ hook to follow the lines where the front end shows the breakpoints of file """
+    pass
+  def move(self, bno, line):
+    """ move break point numbered with bno to line """
+    bp = self.dictionaries.get(bno)
+    if bp != None and bp['line'] != line:
+      if self.index.get((bp['file'], bp['line'])) == bno:
+        del self.index[(bp['file'], bp['line'])]
+      bp['line'] = line
+      self.index[(bp['file'], bp['line'])] = bno
+  def find(self, file, line):
+    """ find break point and return bno(breakpoint number) """
+    self.sync(file)
+    return self.index.get((file, int(line)))
+  def getfile(self, bno):
+    """ get file name of breakpoint numbered with bno """
+    return self.dictionaries[bno]['file']
+  def getline(self, bno):
+    """ get line number of breakpoint numbered with bno """
+    return self.dictionaries[bno]['line']
+  def getexp(self, bno):
+    """ get expression of breakpoint numbered with bno """
+    return self.dictionaries[bno]['exp']
+  def getoptions(self, bno):
+    """ get hit count and log options of breakpoint numbered with bno, as add() takes them """
+    bp = self.dictionaries[bno]
+    return {'hits':bp['hits'], 'hitcond':bp['hitcond'], 'log':bp['log']}
+  def getlog(self, bno):
+    """ get expressions logged by breakpoint numbered with bno, [] if it is not a logpoint """
+    return self.dictionaries[bno]['log']
+  def args(self, bno, fn):
+    """ arguments of breakpoint_set for breakpoint numbered with bno in remote file fn """
+    bp = self.dictionaries[bno]
+    args = '-t line -f ' + fn + ' -n ' + str(bp['line']) + ' -s enabled'
+    if bp['hits']:
+      args += ' -h %d -o %s' % (bp['hits'], bp['hitcond'])
+    return args
+  def logpointAt(self, file, line):
+    """ number of the logpoint at file:line, None if there is none """
+    bno = self.index.get((file, int(line)))
+    if bno in self.logpoints:
+      return bno
+    return None
+  def list(self):
+    """ return list of breakpoint number """
+    return self.dictionaries.keys()
+
+class PropertyFormatter(object):
+  """ text of the properties in replies of context_get, property_get and eval """
+  language = 'php'
+  def decode_string(self, msg, encoding):
+    if encoding == 'base64':
+      value = base64.decodestring(msg)
+    elif encoding == '' or encoding == None or encoding == 'None':
+      value = msg
+    else:
+      value = "(e:%s) %s" % (encoding, msg)
+    return value
+  def parseNode1(self, p):
+    fullname = p.get('fullname')
+    if fullname == None:
+      fullname = p.get('name')
+    val = None
+    if p.text != None:
+      val = self.decode_string(p.text, p.get('encoding'))
+    return (fullname, val)
+  def parseNode2(self, p):
+    fullname_node = p.find('{urn:debugger_protocol_v1}fullname')
+    fullname = self.decode_string(fullname_node.text, fullname_node.get('encoding'))
+    value_node = p.find('{urn:debugger_protocol_v1}value')
+    val = None
+    if value_node != None and value_node.text != None:
+      val = self.decode_string(value_node.text, value_node.get('encoding'))
+    return (fullname, val)
+  def parseProperty(self, p, level, parser, command = None):
+    (fullname, val) = parser(p)
+    if command == 'eval':
+      if self.language == 'php':
+        fullname = "$evalResult" if (fullname == None) else ('$evalResult->%s'%(fullname))
+      else:
+        fullname = "evalResult" if (fullname == None) else ('evalResult->%s'%(fullname))
+    else:
+      fullname = "" if (fullname == None) else fullname
+    tp = p.get('type')
+    children = p.get('children')
+    properties = p.findall('{urn:debugger_protocol_v1}property')
+    size = p.get('size')
+    if size == None:
+      size = p.get('numchildren')
+    size = ('[%s]' % (size)) if size != None else ""
+    if val != None:
+      value = "(%s%s) '%s'" % (tp, size, val)
+    elif tp == "null":
+      value = "(null)"
+    else:
+      if tp == "object":
+        tp = tp+"|"+p.get('classname')
+      if children == "1" and len(properties) == 0:
+        value = "(%s%s)+" % (tp, size)
+      else:
+        value = "(%s%s)" % (tp, size)
+    out = ('%s%s = %s;' % (" "*level, fullname.ljust(32-level), value))
+    children = self.parseChildren(p, properties, level+2, parser, command, fullname)
+    if children:
+      out += '\n'+children
+    return out
+  def parseChildren(self, p, properties, level, parser, command, fullname):
+    """ render one page of children, followed by a placeholder for the next page """
+    out = []
+    for pp in properties:
+      out.append(self.parseProperty(pp, level, parser, command))
+    numchildren = p.get('numchildren')
+    if numchildren != None and len(properties) > 0:
+      page = int(p.get('page', '0'))
+      pagesize = int(p.get('pagesize', str(len(properties))))
+      rest = int(numchildren) - page*pagesize - len(properties)
+      if rest > 0:
+        out.append('%s... %d more of %s (page %d)' % (" "*level, rest, fullname, page+1))
+    return '\n'.join(out)
+  def parseValue(self, xml):
+    """ the value of the first property of xml on one line, or its error """
+    error = xml.find('{urn:debugger_protocol_v1}error')
+    if error != None:
+      message = error.find('{urn:debugger_protocol_v1}message')
+      return '(error %s) %s' % (error.get('code'), message.text if message != None else '')
+    first = self.parseResponse(xml).split('\n', 1)[0]
+    if ' = ' not in first:
+      return first
+    return first[first.find(' = ')+3:].rstrip(';')
+  def parseResponse(self, xml):
+    """ all properties of xml, one per line and their children indented """
+    properties = xml.findall('{urn:debugger_protocol_v1}property')
+    if len(properties) == 0:
+      return ''
+    if properties[0].find('{urn:debugger_protocol_v1}fullname') != None:
+      parser = getattr(self, 'parseNode2')
+    else:
+      parser = getattr(self, 'parseNode1')
+    return '\n'.join([self.parseProperty(p, 0, parser, xml.get('command')) for p in properties])
+
+class DbgFrontend(object):
+  """ settings and hooks of whatever drives the sessions
+
+  The defaults suit a headless client. DBGPavim reads the settings from
+  the g:dbgPavim* variables and shows sessions and status in Vim. """
+  def __init__(self, port = 9000):
+    self.port = port
+    self.maxChildren = '1024'
+    self.maxData = '1024'
+    self.maxDepth = '1'
+    self.breakAtEntry = 0
+    self.dbgPavimOnce = 0
+    self.pipeline = 1
+    self.cacheSize = 4194304
+    self.paths = PathMap([])
+    self.fetchSource = 1
+    self.sources = SourceCache(os.path.join(os.path.expanduser("~"), ".dbgpavim.sources"))
+    self.breakpt = BreakPoint()
+    self.debugListener = None
+    self.logLines = deque(maxlen = 10000)
+    self.admission = DbgAdmission()
+  def remotePathOf(self,lpath):
+    # breakpoints in fetched files go to the file they were fetched from
+    uri = self.sources.uriOf(lpath)
+    if uri != None:
+      return uri
+    return self.paths.remote(lpath)
+  def localPathOf(self,rpath):
+    return self.paths.local(rpath)
+  def localFileOf(self,uri):
+    return self.paths.localFile(uri)
+  def adopt(self, ss):
+    """ the session to queue once DbgListener has set ss up """
+    return ss
+  def sessionQueued(self, ss, count):
+    pass
+  def logged(self, line):
+    """ a line logged by a logpoint, called from the thread of DbgListener """
+    self.logLines.append(line)
+  def message(self, text):
+    """ a line for the user, an empty one clears the last """
+    pass
+  def error(self, text):
+    print >>sys.stderr, text
+  def updateStatusLine(self):
+    pass
+
+frontend = None
+def setFrontend(fe):
+  """ make fe the front end of all sessions """
+  global frontend
+  frontend = fe